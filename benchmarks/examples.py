@@ -0,0 +1,186 @@
+"""
+Measure how quickly the engine finds and shrinks the bugs in the bundled
+examples, and compare the results against a saved baseline.
+
+Every example is run once per seed. For each we record how many programs the
+search ran up to and including its first failure, how many executions
+minimization needed, and how long the final program was. These are counts,
+which only change when the engine does, so they can be compared against a
+baseline without noise. We also record how many operations and failures per
+second the search ran and found, taking the median over several repeats of
+the search as these depend on how busy the machine is. For the same reason
+the time the search took to find its first failure, which is usually well
+under a millisecond, is reported but never compared.
+
+Usage:
+    python benchmarks/examples.py --save baseline.json
+    python benchmarks/examples.py --baseline baseline.json [--threshold 0.25]
+
+The second form exits with a non-zero status if any metric is worse than the
+baseline by more than the threshold, as a fraction of the baseline value.
+"""
+
+import argparse
+import json
+import sys
+
+from testmachine.examples import (
+    commutativeints, floats, nonuniquelists, unbalancedtrees
+)
+from testmachine.testmachine import NoFailingProgram
+
+EXAMPLES = (floats, nonuniquelists, unbalancedtrees, commutativeints)
+
+# Metrics where smaller numbers are better. For everything else bigger is.
+LOWER_IS_BETTER = (
+    "programs_to_first_failure", "minimization_executions", "final_length",
+)
+RATES = ("operations_per_second", "failures_per_second")
+# Metrics too noisy to be compared against a baseline, which are only shown
+REPORTED = ("time_to_first_failure",)
+METRICS = LOWER_IS_BETTER + RATES + REPORTED
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def measure(
+    machine, seed, swarm=False, adaptive=False, corpus=False, repeats=3
+):
+    machine.seed = seed
+    machine.print_output = False
+    machine.swarm = swarm
+    machine.adaptive = adaptive
+    machine.corpus = corpus
+    rates = dict((rate, []) for rate in RATES + REPORTED)
+    for _ in range(repeats):
+        # Seeded searches are reproducible, so every repeat finds the same
+        # program and only the rates differ.
+        try:
+            program = machine.find_failing_program()
+        except NoFailingProgram:
+            program = None
+        stats = machine.search_stats
+        rates["operations_per_second"].append(
+            stats.operations / stats.elapsed
+        )
+        rates["failures_per_second"].append(stats.failures / stats.elapsed)
+        if stats.first_failure is not None:
+            rates["time_to_first_failure"].append(stats.first_failure)
+    result = dict(
+        (rate, median(values)) for rate, values in rates.items() if values
+    )
+    result["programs_to_first_failure"] = stats.programs_to_first_failure
+    if program is not None:
+        executions = machine.executions
+        minimal = machine.minimize_failing_program(program)
+        result["minimization_executions"] = machine.executions - executions
+        result["final_length"] = len(minimal)
+    return result
+
+
+def run_examples(seeds, swarm=False, adaptive=False, corpus=False, repeats=3):
+    """
+    Returns a dict mapping each example's name to the mean over seeds of each
+    metric that it produced.
+    """
+    results = {}
+    for example in EXAMPLES:
+        name = example.__name__.split(".")[-1]
+        samples = [
+            measure(example.machine, seed, swarm, adaptive, corpus, repeats)
+            for seed in seeds
+        ]
+        results[name] = {}
+        for metric in METRICS:
+            values = [
+                s[metric] for s in samples if s.get(metric) is not None
+            ]
+            if values:
+                results[name][metric] = sum(values) / float(len(values))
+    return results
+
+
+def regressions(baseline, results, threshold):
+    """
+    Yield a description of every metric in results that is worse than in
+    baseline by more than threshold.
+    """
+    for name, metrics in sorted(results.items()):
+        for metric, value in sorted(metrics.items()):
+            if metric in REPORTED:
+                continue
+            try:
+                old = baseline[name][metric]
+            except KeyError:
+                continue
+            if metric in LOWER_IS_BETTER:
+                worse = value > old * (1 + threshold)
+            else:
+                worse = value < old * (1 - threshold)
+            if worse:
+                yield "%s %s: %.4g -> %.4g" % (name, metric, old, value)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split("\n")[0]
+    )
+    parser.add_argument(
+        "--seeds", type=int, nargs="+", default=[0, 1, 2, 3, 4],
+    )
+    parser.add_argument("--save", metavar="FILE", help="Write results to FILE")
+    parser.add_argument(
+        "--baseline", metavar="FILE", help="Compare results with FILE",
+    )
+    parser.add_argument(
+        "--threshold", type=float, default=0.25,
+        help="Fraction by which a metric may worsen before it is reported",
+    )
+    parser.add_argument(
+        "--repeats", type=int, default=3,
+        help="Take the median of the rates over this many searches",
+    )
+    parser.add_argument(
+        "--swarm", action="store_true", help="Search in swarm mode",
+    )
+    parser.add_argument(
+        "--adaptive", action="store_true", help="Search in adaptive mode",
+    )
+    parser.add_argument(
+        "--corpus", action="store_true", help="Search in corpus mode",
+    )
+    options = parser.parse_args(args)
+
+    results = run_examples(
+        options.seeds, options.swarm, options.adaptive, options.corpus,
+        options.repeats,
+    )
+    for name, metrics in sorted(results.items()):
+        print("%-16s %s" % (name, ", ".join(
+            "%s=%.4g" % (metric, metrics[metric])
+            for metric in METRICS if metric in metrics
+        )))
+
+    if options.save:
+        with open(options.save, "w") as f:
+            json.dump(results, f, sort_keys=True, indent=2)
+
+    if options.baseline:
+        with open(options.baseline) as f:
+            baseline = json.load(f)
+        found = list(regressions(baseline, results, options.threshold))
+        for regression in found:
+            print("REGRESSION " + regression)
+        if found:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,79 @@
+"""
+Measure how many operations per second a testmachine can generate.
+
+The machine used is deliberately wide (several varstacks, each with the full
+set of common operations) because that is where the cost of selecting an
+operation dominates the cost of running it.
+
+Usage:
+    python benchmarks/generation.py [--programs N] [--length N]
+
+Pass --rebuild to rebuild the machine's language before every step, which is
+what happened before the compiled language was cached, and --traced to record
+every step as happened before the search ran untraced.
+"""
+
+import argparse
+import time
+from random import Random
+
+from testmachine import TestMachine
+from testmachine.common import ints, lists, check
+from testmachine.operations import ChooseFrom
+from testmachine.testmachine import RunContext
+
+
+def wide_machine(width=4):
+    machine = TestMachine(print_output=False)
+    for i in range(width):
+        source = "ints%d" % (i,)
+        machine.add(
+            ints(source),
+            lists(source=source, target="lists%d" % (i,)),
+            check(lambda x: True, (source,), name="ok"),
+        )
+    return machine
+
+
+def operations_per_second(
+    machine, programs, length, rebuild=False, traced=False, seed=0
+):
+    random = Random(seed)
+    total = 0
+    start = time.time()
+    for _ in range(programs):
+        context = RunContext(
+            random=Random(random.getrandbits(64)), trace=traced
+        )
+        for _ in range(length):
+            if rebuild:
+                language = ChooseFrom(machine.languages)
+            else:
+                language = machine.language
+            context.execute(language.generate(context))
+            total += 1
+    return total / (time.time() - start)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--programs", type=int, default=100)
+    parser.add_argument("--length", type=int, default=200)
+    parser.add_argument("--width", type=int, default=4)
+    parser.add_argument("--rebuild", action="store_true", default=False)
+    parser.add_argument("--traced", action="store_true", default=False)
+    results = parser.parse_args(args)
+    machine = wide_machine(results.width)
+    rate = operations_per_second(
+        machine, results.programs, results.length,
+        rebuild=results.rebuild, traced=results.traced,
+    )
+    print("%s, %s: %.0f operations/second" % (
+        "rebuild" if results.rebuild else "cached",
+        "traced" if results.traced else "untraced",
+        rate,
+    ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Compare how many program executions each minimizer needs to shrink the same
+failing programs to a fixpoint.
+
+The machine used only fails after a long run of operations, so the failing
+programs it finds are long and only a scattered fraction of their steps is
+relevant to the failure, which is the case the greedy minimizer has the most
+trouble with.
+
+Usage:
+    python benchmarks/minimization.py [--length N] [--samples N]
+"""
+
+import argparse
+import time
+from random import Random
+
+from testmachine import TestMachine
+from testmachine.common import (
+    basic_operations, binary_operation, check, generate
+)
+from testmachine.testmachine import MINIMIZERS
+
+
+# Seconds each addition sleeps for. Only set once the failing programs have
+# been found, so that the search itself stays fast.
+settings = {"delay": 0}
+
+
+def rare_failure_machine(length):
+    # Fails once enough values have been summed together, so the minimal
+    # program is spread throughout the failing one rather than sitting at the
+    # end of it.
+    machine = TestMachine(prog_length=length, print_output=False)
+
+    def add(x, y):
+        if settings["delay"]:
+            time.sleep(settings["delay"])
+        return x + y
+
+    machine.add(
+        basic_operations("ints"),
+        generate(lambda r: r.randint(0, 100), "ints"),
+        binary_operation(add, "ints", "+"),
+        check(lambda x: x < length * 2, ("ints",), name="small"),
+    )
+    return machine
+
+
+def failing_programs(machine, samples, seed):
+    random = Random(seed)
+    found = []
+    while len(found) < samples:
+        program, failed = machine.generate_program(
+            Random(random.getrandbits(64))
+        )
+        if failed and len(program) >= machine.prog_length // 2:
+            found.append(program)
+    return found
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--length", type=int, default=500)
+    parser.add_argument("--samples", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--workers", type=int, default=1,
+        help="Number of processes to evaluate candidates with",
+    )
+    parser.add_argument(
+        "--delay", type=float, default=0,
+        help="Seconds each addition sleeps for, to simulate an expensive "
+             "system under test",
+    )
+    parser.add_argument(
+        "--minimizers", nargs="+", default=sorted(MINIMIZERS),
+        choices=sorted(MINIMIZERS),
+    )
+    results = parser.parse_args(args)
+    machine = rare_failure_machine(results.length)
+    programs = failing_programs(machine, results.samples, results.seed)
+    machine.workers = results.workers
+    settings["delay"] = results.delay
+
+    for name in results.minimizers:
+        machine.minimizer = name
+        for program in programs:
+            machine.executions = 0
+            start = time.time()
+            minimal = machine.minimize_failing_program(program)
+            print("%-8s %5d steps -> %3d steps: %7d executions in %.2fs" % (
+                name, len(program), len(minimal), machine.executions,
+                time.time() - start,
+            ))
+
+
+if __name__ == '__main__':
+    main()
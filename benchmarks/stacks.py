@@ -0,0 +1,53 @@
+"""
+Micro-benchmark of the basic VarStack operations that every step of every
+program goes through.
+
+Usage:
+    python benchmarks/stacks.py [--operations N]
+"""
+
+import argparse
+import time
+
+from testmachine.testmachine import RunContext
+
+
+def push_pop(varstack, n):
+    for i in range(n):
+        varstack.push(i)
+        varstack.push(i)
+        varstack.pop()
+        varstack.pop()
+    return 4 * n
+
+
+def peek_dup(varstack, n):
+    varstack.push(0)
+    for i in range(n):
+        varstack.peek()
+        varstack.dup()
+        varstack.has(2)
+        varstack.pop()
+    return 4 * n
+
+
+BENCHMARKS = (push_pop, peek_dup)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--operations", type=int, default=250000)
+    results = parser.parse_args(args)
+    for benchmark in BENCHMARKS:
+        context = RunContext()
+        context.reset_tracking()
+        varstack = context.varstack("ints")
+        start = time.time()
+        count = benchmark(varstack, results.operations // 4)
+        print("%-10s %10.0f stack operations/second" % (
+            benchmark.__name__, count / (time.time() - start)
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -8,6 +8,7 @@ from .operations import (
     ReadAndWrite,
     Check,
     PushRandom,
+    ChooseFrom,
 )
 
 
@@ -27,8 +28,8 @@ def binary_operation(*args, **kwargs):
     return BinaryOperator(*args, **kwargs)
 
 
-def unary_operation(operation, varstack, name):
-    return UnaryOperator(operation, varstack, name)
+def unary_operation(operation, varstack, name, latency_budget=None):
+    return UnaryOperator(operation, varstack, name, latency_budget)
 
 
 def check(*args, **kwargs):
@@ -48,6 +49,18 @@ def generate(*args, **kwargs):
     return PushRandom(*args, **kwargs)
 
 
+def weighted(weight, language):
+    """
+    Make language, or a group of languages, weight times as likely to be
+    chosen as it otherwise would be. Useful for making sure that a rare but
+    important operation is not drowned out by many uninteresting ones.
+    """
+    if isinstance(language, (tuple, list)):
+        language = ChooseFrom(language)
+    language.weight = weight
+    return language
+
+
 def basic_operations(varstack):
     """
     Define basic stack shuffling and manipulation operations on varstack.
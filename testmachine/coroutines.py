@@ -0,0 +1,101 @@
+"""
+Support for operations implemented as coroutines, for testing asyncio code.
+
+Any function given to an operation, check or generator may return an
+awaitable, such as the coroutine returned by calling an async def function,
+instead of a value. The awaitable is run to completion on an event loop which
+is shared by everything in the process and runs in a background thread, so
+the cost of starting a loop is only paid once. Because the loop has a thread
+of its own, programs run from several threads at once, as TestMachine does
+when its concurrency is above one, have their waits overlapped on it.
+
+asyncio needs Python 3.4 or later. On earlier versions nothing is ever
+treated as awaitable.
+"""
+
+import os
+import threading
+
+try:
+    import asyncio
+except ImportError:
+    asyncio = None
+
+try:
+    from inspect import isawaitable
+except ImportError:
+    def isawaitable(value):
+        return asyncio is not None and (
+            asyncio.iscoroutine(value) or isinstance(value, asyncio.Future)
+        )
+
+_lock = threading.Lock()
+_loop = None
+_thread = None
+_pid = None
+
+
+def event_loop():
+    """
+    Return the event loop awaitables are run on in this process, starting it
+    if need be. Event loops do not survive a fork, so a forked process gets
+    a new one.
+    """
+    global _loop, _thread, _pid
+    with _lock:
+        if _loop is None or _pid != os.getpid():
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(
+                target=loop.run_forever, name="testmachine event loop"
+            )
+            thread.daemon = True
+            thread.start()
+            _loop, _thread, _pid = loop, thread, os.getpid()
+        return _loop
+
+
+def resolve(value):
+    """
+    If value is awaitable, wait for it on the event loop and return its
+    result, else return value unchanged.
+    """
+    if asyncio is None or not isawaitable(value):
+        return value
+    return run(value)
+
+
+def run(awaitable):
+    """
+    Run awaitable on the event loop, blocking the calling thread until it is
+    done, and return its result or raise its exception.
+    """
+    loop = event_loop()
+    if threading.current_thread() is _thread:
+        raise RuntimeError(
+            "Cannot wait for an awaitable from inside the event loop"
+        )
+    outcome = []
+    finished = threading.Event()
+
+    def on_done(future):
+        try:
+            outcome.append((future.result(), None))
+        except BaseException as e:
+            outcome.append((None, e))
+        finished.set()
+
+    def start():
+        try:
+            future = asyncio.ensure_future(awaitable, loop=loop)
+        except BaseException as e:
+            outcome.append((None, e))
+            finished.set()
+        else:
+            future.add_done_callback(on_done)
+
+    loop.call_soon_threadsafe(start)
+    finished.wait()
+    value, error = outcome[0]
+    if error is not None:
+        raise error
+    return value
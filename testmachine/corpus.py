@@ -0,0 +1,99 @@
+"""
+A corpus of programs which each did something no program run before them
+had, for searches to mutate into new programs instead of always generating
+them from scratch.
+
+What a program did is summarised as a set of features:
+
+    ("pair", i, j)         a step with leaf index i was followed by one with j
+    ("error", name, i)     the step with leaf index i raised an exception of
+                           the type called name
+    ("depth", stack, n)    the varstack named stack held n values at once
+
+so a program is novel if it runs two operations one after the other that
+have never been run that way before, fails in a new way, or piles up more
+values than ever before.
+"""
+
+
+def program_features(program, error, depths):
+    """
+    The features of a run of program, a Program, which raised error or None
+    if it did not fail and reached the deepest stack sizes in depths, a dict
+    mapping varstack names to the most values they held.
+    """
+    indices = program.steps[0::2]
+    features = set(
+        ("pair", indices[i], indices[i + 1])
+        for i in range(len(indices) - 1)
+    )
+    if error is not None and indices:
+        features.add(("error", type(error).__name__, indices[-1]))
+    for name, depth in depths.items():
+        features.add(("depth", name, depth))
+    return frozenset(features)
+
+
+class Corpus(object):
+    """
+    Programs with features that no program added before them had, up to
+    max_size of them. Once full, adding a program evicts whichever one's
+    features are most common among the others, so that programs are kept
+    for the rarest things they do.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = []
+        self.counts = {}
+        self.seen = set()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return (program for program, _ in self.entries)
+
+    def add(self, program, features):
+        """
+        Keep program if it has any features that have never been seen
+        before, even in programs which have since been evicted. Returns
+        whether it was kept.
+        """
+        new = features - self.seen
+        if not new:
+            return False
+        self.seen |= new
+        self.entries.append((program, features))
+        counts = self.counts
+        for feature in features:
+            counts[feature] = counts.get(feature, 0) + 1
+        if len(self.entries) > self.max_size:
+            self.evict()
+        return True
+
+    def rarity(self, features):
+        return sum(1.0 / self.counts[feature] for feature in features)
+
+    def evict(self):
+        """
+        Remove the program with the lowest total rarity of its features,
+        where a feature's rarity is one over the number of programs which
+        have it.
+        """
+        entries = self.entries
+        i = min(
+            range(len(entries)), key=lambda i: self.rarity(entries[i][1])
+        )
+        _, features = entries.pop(i)
+        counts = self.counts
+        for feature in features:
+            counts[feature] -= 1
+            if not counts[feature]:
+                del counts[feature]
+
+    def choose(self, random):
+        """
+        A program from the corpus chosen uniformly at random.
+        """
+        return random.choice(self.entries)[0]
@@ -0,0 +1,78 @@
+"""
+On disk storage for failing programs, so that a failure found by one run can
+be replayed straight away by the next.
+"""
+
+import hashlib
+import os
+
+
+class ExampleDatabase(object):
+    """
+    A directory of serialized programs grouped under string keys. Each key
+    gets its own subdirectory, and each program is a file in it named after
+    a hash of its contents, so saving the same program twice is harmless.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def _directory(self, key):
+        return os.path.join(self.path, key)
+
+    def _filename(self, key, data):
+        return os.path.join(
+            self._directory(key), hashlib.sha1(data).hexdigest()[:16]
+        )
+
+    def save(self, key, data):
+        directory = self._directory(key)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # Another run may have made it since we checked.
+                if not os.path.isdir(directory):
+                    raise
+        filename = self._filename(key, data)
+        # Write to a temporary file and rename it into place so that a
+        # concurrent run never sees a partially written program.
+        temporary = "%s.%d.tmp" % (filename, os.getpid())
+        with open(temporary, "wb") as f:
+            f.write(data)
+        os.rename(temporary, filename)
+
+    def fetch(self, key):
+        """
+        Yield the contents of every program saved under key, oldest first.
+        Programs which a concurrent run deletes while we are fetching are
+        skipped.
+        """
+        directory = self._directory(key)
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            return
+        entries = []
+        for name in names:
+            if name.endswith(".tmp"):
+                continue
+            filename = os.path.join(directory, name)
+            try:
+                entries.append((os.path.getmtime(filename), filename))
+            except OSError:
+                continue
+        entries.sort()
+        for _, filename in entries:
+            try:
+                with open(filename, "rb") as f:
+                    data = f.read()
+            except (IOError, OSError):
+                continue
+            yield data
+
+    def delete(self, key, data):
+        try:
+            os.unlink(self._filename(key, data))
+        except OSError:
+            pass
@@ -0,0 +1,122 @@
+"""
+Detect programs which keep hold of more and more memory as they run, such as
+those which hit a leak or a cache that grows without bound, which tend to
+show up only after a long sequence of operations.
+
+This needs tracemalloc, so Python 3.4 or later.
+"""
+
+import os
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+# How many frames of each allocation tracemalloc records when we want to
+# report where growth came from and not just whether there was any. Every
+# extra frame makes tracing slower, by several times over at this many.
+FRAMES = 10
+
+_directory = os.path.dirname(os.path.abspath(__file__))
+
+# Modules whose allocations are the bookkeeping of running a program, rather
+# than anything the program itself does
+_internal = frozenset(
+    os.path.join(_directory, name + ".py") for name in (
+        "coroutines", "memory", "operations", "profiling", "program",
+        "testmachine",
+    )
+)
+
+
+def _statistics():
+    """
+    Statistics by traceback of the memory traced, leaving out anything
+    allocated directly by testmachine or by tracemalloc. This is much faster
+    than filtering the snapshot with tracemalloc.Filter, which matches every
+    trace against a glob pattern.
+    """
+    return [
+        stat for stat in tracemalloc.take_snapshot().statistics("traceback")
+        if stat.traceback[-1].filename not in _internal and
+        stat.traceback[-1].filename != tracemalloc.__file__
+    ]
+
+
+def is_tracing():
+    """
+    Whether tracemalloc is tracing, which it never is before Python 3.4.
+    """
+    return tracemalloc is not None and tracemalloc.is_tracing()
+
+
+def stop_tracing():
+    """
+    Stop tracemalloc, which frees every trace it has collected.
+    """
+    tracemalloc.stop()
+
+
+class MemoryTracker(object):
+    """
+    Watches the memory held on to by a single run of a program, from when
+    the tracker is created. Starts tracemalloc recording frames frames of
+    each allocation if it is not already doing so, and leaves it on so that
+    the next run need not start it again. Whatever runs programs with
+    trackers is responsible for calling stop_tracing once it has finished.
+
+    Creating a tracker clears every trace tracemalloc has collected so far,
+    so that from then on it only traces memory allocated by this run and
+    still in use. That is exactly the memory retained by the program, and
+    keeps snapshots as small as they can be, but it means that nothing else
+    in the process can rely on tracemalloc at the same time.
+
+    Every interval steps the tracker checks whether the memory traced has
+    grown past threshold bytes, and if so takes a snapshot to find out where
+    it was allocated. Allocations made directly by testmachine itself, such
+    as those for its stacks, are not counted, so the program is only
+    considered to be retaining too much if what remains is still over
+    threshold. Values the program keeps on its stacks were allocated by its
+    operations though, so do count, and threshold has to allow for them.
+    """
+
+    def __init__(self, threshold, interval, frames=1):
+        if tracemalloc is None:
+            raise RuntimeError("Tracking memory needs Python 3.4 or later")
+        self.threshold = threshold
+        self.interval = interval
+        self.steps = 0
+        if (
+            tracemalloc.is_tracing() and
+            tracemalloc.get_traceback_limit() == frames
+        ):
+            tracemalloc.clear_traces()
+        else:
+            # Stopping clears the traces too.
+            tracemalloc.stop()
+            tracemalloc.start(frames)
+        self.next_check = threshold
+
+    def step(self):
+        """
+        Record that another step has run. Returns None unless this step is
+        due a check which finds the growth over threshold, in which case it
+        returns a pair (growth, lines) of the number of bytes grown by and
+        the formatted traceback of the allocations that grew the most.
+        """
+        self.steps += 1
+        if self.steps % self.interval:
+            return None
+        traced = tracemalloc.get_traced_memory()[0]
+        if traced <= self.next_check:
+            return None
+        stats = _statistics()
+        growth = sum(stat.size for stat in stats)
+        if growth <= self.threshold:
+            # What we leave out of the growth is unlikely to shrink, so it
+            # cannot be over threshold again until at least this much more
+            # has been traced, and until then we skip the snapshot.
+            self.next_check = traced + self.threshold - growth
+            return None
+        return growth, stats[0].traceback.format()
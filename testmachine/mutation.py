@@ -0,0 +1,114 @@
+"""
+Random changes to programs, for searches which build on the programs they
+have already found rather than only generating new ones.
+
+Every mutation takes a Random and a Program and returns a new Program made
+from the (index, seed) steps of its input, without running anything. The
+result need not be a valid program, as steps may have been moved to where
+their arguments are not available, so it should be run with pruning as
+TestMachine.prune_and_evaluate does.
+"""
+
+from .operations import PushRandom
+from .program import Program
+
+
+def _span(random, n):
+    """
+    A random nonempty range (start, end) of the steps of a program of n.
+    """
+    start = random.randrange(n)
+    return start, random.randint(start + 1, n)
+
+
+def delete(random, program):
+    """
+    Remove a random run of steps.
+    """
+    n = len(program)
+    if n <= 1:
+        return program
+    start, end = _span(random, n)
+    steps = program.steps
+    return Program(
+        program.language, steps[:2 * start] + steps[2 * end:],
+        program.enabled,
+    )
+
+
+def truncate(random, program):
+    """
+    Cut program off after a random step.
+    """
+    return program[:random.randint(0, len(program))]
+
+
+def duplicate(random, program):
+    """
+    Copy a random run of steps to a random position, which repeats whatever
+    work they do on the values they find there.
+    """
+    n = len(program)
+    if not n:
+        return program
+    start, end = _span(random, n)
+    steps = program.steps
+    at = 2 * random.randint(0, n)
+    return Program(
+        program.language,
+        steps[:at] + steps[2 * start:2 * end] + steps[at:],
+        program.enabled,
+    )
+
+
+def reseed(random, program):
+    """
+    Change the seed of a random step which pushes a generated value, so that
+    it pushes a different one.
+    """
+    leaves = program.language.leaves
+    steps = program.steps
+    pushes = [
+        i for i in range(0, len(steps), 2)
+        if isinstance(leaves[steps[i]], PushRandom)
+    ]
+    if not pushes:
+        return program
+    steps = steps[:]
+    steps[random.choice(pushes) + 1] = random.getrandbits(32)
+    return Program(program.language, steps, program.enabled)
+
+
+def splice(random, program, other):
+    """
+    Join the start of program to the end of other, cutting each at a random
+    step.
+    """
+    cut = 2 * random.randint(0, len(program))
+    other_cut = 2 * random.randint(0, len(other))
+    return Program(
+        program.language, program.steps[:cut] + other.steps[other_cut:],
+        program.enabled,
+    )
+
+
+def mutate(random, program, others=(), max_length=None):
+    """
+    Apply a randomly chosen mutation to program, splicing it with one of
+    others if the choice falls on splice and there are any. If max_length
+    is given the result is cut down to that many steps.
+    """
+    choice = random.randrange(5 if others else 4)
+    if choice == 0:
+        result = delete(random, program)
+    elif choice == 1:
+        result = truncate(random, program)
+    elif choice == 2:
+        result = duplicate(random, program)
+    elif choice == 3:
+        result = reseed(random, program)
+    else:
+        result = splice(random, program, random.choice(others))
+    if max_length is not None and len(result) > max_length:
+        result = result[:max_length]
+    return result
@@ -0,0 +1,103 @@
+"""
+Costs for a testmachine to search for programs which maximize, rather than
+for programs which fail.
+
+An objective's start method is called just before a program runs and its
+finish method just after, with the RunContext the program ran in, and finish
+returns the cost of that run as a number. Costs need not be exact or
+repeatable, but the search can only climb as far as they tell apart better
+programs from worse ones.
+"""
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from .profiling import timer
+
+
+class Objective(object):
+    # What costs are measured in, for reporting them
+    unit = ""
+
+    def start(self):
+        pass
+
+    def finish(self, context):
+        raise NotImplementedError()
+
+
+class WallTime(Objective):
+    """
+    The number of seconds a program takes to run.
+    """
+
+    unit = "s"
+
+    def __init__(self):
+        self.started = None
+
+    def start(self):
+        self.started = timer()
+
+    def finish(self, context):
+        return timer() - self.started
+
+
+class Counter(Objective):
+    """
+    How much a counter goes up by while a program runs, where read is a
+    function returning its current value. For example a count of queries
+    made or of nodes visited that the system under test keeps.
+    """
+
+    def __init__(self, read, unit=""):
+        self.read = read
+        self.unit = unit
+        self.before = None
+
+    def start(self):
+        self.before = self.read()
+
+    def finish(self, context):
+        return self.read() - self.before
+
+
+class PeakMemory(Objective):
+    """
+    The most bytes allocated at once while a program runs, over and above
+    what was already allocated when it started, as traced by tracemalloc.
+    Tracing is started for each run if it is not already on, which slows
+    every allocation down.
+    """
+
+    unit = "B"
+
+    def __init__(self):
+        if tracemalloc is None:
+            raise RuntimeError("Measuring memory needs Python 3.4 or later")
+        self.stop = False
+        self.baseline = 0
+
+    def start(self):
+        self.stop = not tracemalloc.is_tracing()
+        if self.stop:
+            tracemalloc.start()
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        else:
+            tracemalloc.clear_traces()
+        self.baseline = tracemalloc.get_traced_memory()[0]
+
+    def finish(self, context):
+        peak = tracemalloc.get_traced_memory()[1] - self.baseline
+        if self.stop:
+            tracemalloc.stop()
+        return peak
+
+
+OBJECTIVES = {
+    "time": WallTime,
+    "memory": PeakMemory,
+}
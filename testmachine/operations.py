@@ -2,10 +2,20 @@ from operator import itemgetter
 from collections import defaultdict
 from random import Random
 
+from .coroutines import resolve
+from .profiling import timer
+
 
 class OperationOrLanguage(object):
     precondition = None
 
+    # How likely a ChooseFrom is to pick this relative to its other children
+    weight = 1.0
+
+    # The most seconds a single invocation may take before it counts as a
+    # failure, or None to use the default of the context it runs in
+    latency_budget = None
+
     def applicable(self, context):
         for varstack, req in self.requirements.items():
             if not context.varstack(varstack).has(req):
@@ -19,7 +29,7 @@ class OperationOrLanguage(object):
 class Operation(OperationOrLanguage):
     def __init__(
             self, varstacks, name=None, pattern=None, patterns=None,
-            precondition=None):
+            precondition=None, latency_budget=None):
         if pattern and patterns:
             raise ValueError(
                 "Cannot specify both a single and multiple patterns"
@@ -30,9 +40,12 @@ class Operation(OperationOrLanguage):
         self.name = name or self.__class__.__name__.lower()
         self.requirements = defaultdict(lambda: 0)
         for s, c in varstacks:
-            self.requirements[s] += c
+            # Arguments which consume their value are requirements on the
+            # varstack they consume from.
+            self.requirements[getattr(s, "varstack", s)] += c
         self.patterns = patterns
         self.precondition = precondition
+        self.latency_budget = latency_budget
 
     def __repr__(self):
         return "Operation(%s)" % self.display()
@@ -66,7 +79,7 @@ class Operation(OperationOrLanguage):
 class ReadAndWrite(Operation):
     def __init__(
         self, function, argspec, target=None, targets=None, name=None,
-        precondition=None, pattern=None, patterns=None,
+        precondition=None, pattern=None, patterns=None, latency_budget=None,
     ):
         if target and targets:
             raise ValueError(
@@ -84,6 +97,7 @@ class ReadAndWrite(Operation):
             patterns=patterns,
             pattern=pattern,
             precondition=precondition,
+            latency_budget=latency_budget,
         )
         self.function = function
         self.argspec = argspec
@@ -91,7 +105,7 @@ class ReadAndWrite(Operation):
 
     def invoke(self, context):
         args = context.read(self.argspec)
-        result = self.function(*args)
+        result = resolve(self.function(*args))
         if self.targets:
             if self.single_target:
                 context.varstack(self.targets[0]).push(result)
@@ -115,13 +129,17 @@ class Mutate(Operation):
 
 
 class BinaryOperator(ReadAndWrite):
-    def __init__(self, operation, varstack, name, precondition=None):
+    def __init__(
+        self, operation, varstack, name, precondition=None,
+        latency_budget=None,
+    ):
         super(BinaryOperator, self).__init__(
             function=operation,
             argspec=(varstack, varstack),
             target=varstack,
             name=name,
             precondition=precondition,
+            latency_budget=latency_budget,
         )
 
     def compile(self, arguments, results):
@@ -136,12 +154,13 @@ class BinaryOperator(ReadAndWrite):
 
 
 class UnaryOperator(ReadAndWrite):
-    def __init__(self, operation, varstack, name):
+    def __init__(self, operation, varstack, name, latency_budget=None):
         super(UnaryOperator, self).__init__(
             function=operation,
             argspec=(varstack,),
             target=varstack,
-            name=name
+            name=name,
+            latency_budget=latency_budget,
         )
 
     def compile(self, arguments, results):
@@ -155,7 +174,10 @@ class UnaryOperator(ReadAndWrite):
 
 
 class Check(Operation):
-    def __init__(self, test, argspec, name=None, pattern=None, patterns=None):
+    def __init__(
+        self, test, argspec, name=None, pattern=None, patterns=None,
+        latency_budget=None,
+    ):
         name = name or test.__name__
         if pattern is None and patterns is None:
             arg_string = ', '.join(
@@ -164,14 +186,15 @@ class Check(Operation):
             pattern = "assert %s(%s)" % (name, arg_string)
 
         super(Check, self).__init__(
-            _counts(argspec), name=name, pattern=pattern, patterns=patterns
+            _counts(argspec), name=name, pattern=pattern, patterns=patterns,
+            latency_budget=latency_budget,
         )
         self.argspec = argspec
         self.test = test
 
     def invoke(self, context):
         args = context.read(self.argspec)
-        assert self.test(*args)
+        assert resolve(self.test(*args))
 
 
 class SingleStackOperation(Operation):
@@ -188,11 +211,15 @@ class SingleStackOperation(Operation):
 
 
 class Push(SingleStackOperation):
-    def __init__(self, varstack, gen_value, value_formatter=None):
+    def __init__(self, varstack, gen_value=None, value_formatter=None):
         super(Push, self).__init__(varstack, name="push")
-        self.gen_value = gen_value
+        if gen_value is not None:
+            self.gen_value = gen_value
         self.value_formatter = value_formatter or repr
 
+    def gen_value(self):
+        raise NotImplementedError()
+
     def compile(self, arguments, results):
         assert not arguments
         assert len(results) == 1
@@ -229,29 +256,71 @@ class Language(OperationOrLanguage):
 
 
 class PushRandom(Language):
-    def __init__(self, produce, target, name=None, value_formatter=None):
+    def __init__(
+        self, produce, target, name=None, value_formatter=None,
+        latency_budget=None,
+    ):
         super(PushRandom, self).__init__()
         self.produce = produce
         self.target = target
         self.value_formatter = value_formatter
+        self.latency_budget = latency_budget
+        self.calls = 0
 
-    def generate(self, context):
-        state = context.random.getstate()
+    def produce_value(self, seed):
+        self.calls += 1
+        return resolve(self.produce(Random(seed)))
 
-        def gen_result():
-            r = Random(0)
-            r.setstate(state)
-            return self.produce(r)
+    def generate(self, context):
+        push = SeededPush(self, context.random.getrandbits(32))
+
+        # We produce the value now so that any errors bubble up rather than
+        # being treated as a breaking program. It is kept for when the push
+        # is executed in this context so that it need not be produced twice,
+        # along with how long it took, which counts towards that execution.
+        start = timer()
+        value = push.gen_value()
+        push.pending = (context, value, timer() - start)
+
+        return push
+
+
+class SeededPush(Push):
+    """
+    A Push of the value that source, a PushRandom, produces from a Random
+    seeded with seed. Holding on to just the seed rather than the value or a
+    full Random state keeps programs small, and lets us regenerate a fresh
+    copy of the value whenever the program is run.
+    """
+
+    def __init__(self, source, seed):
+        super(SeededPush, self).__init__(
+            source.target, value_formatter=source.value_formatter
+        )
+        self.source = source
+        self.seed = seed
+        self.pending = None
+        self.latency_budget = source.latency_budget
 
-        # We run this so that any errors bubble up rather than being treated
-        # as a breaking program.
-        gen_result()
+    def gen_value(self):
+        return self.source.produce_value(self.seed)
 
-        return Push(
-            self.target,
-            gen_result,
-            value_formatter=self.value_formatter,
-        )
+    def invoke(self, context):
+        pending = self.pending
+        if pending is not None and pending[0] is context:
+            _, value, elapsed = pending
+            self.pending = None
+        else:
+            # Values may be mutated by the program, so any other run needs a
+            # fresh one.
+            value = self.gen_value()
+            elapsed = None
+        context.varstack(self.varstack).push(value)
+        if elapsed is not None:
+            # As when the whole execution is timed, the push happens even if
+            # it was too slow, so that if the slowness is put down to noise
+            # the stacks still match the program.
+            context.check_latency(self, elapsed)
 
 
 class ChooseFrom(Language):
@@ -264,25 +333,241 @@ class ChooseFrom(Language):
             adjusted.append(c)
         children = tuple(adjusted)
         self.children = children
-        self.requirements = defaultdict(lambda: 0)
+
+        # A stack is only required of the whole language if every child
+        # requires it, in which case we need at least the smallest of those
+        # requirements.
+        self.requirements = {}
+        if children:
+            for k in children[0].requirements:
+                if all(k in c.requirements for c in children):
+                    self.requirements[k] = min(
+                        c.requirements[k] for c in children
+                    )
+
+        # The children which can run only depend on the heights of the stacks
+        # they require, and no child cares about a height beyond the largest
+        # requirement on that stack. So we index the applicable children by
+        # the heights of those stacks, capped at that largest requirement.
+        caps = defaultdict(lambda: 0)
         for c in children:
             for k, v in c.requirements.items():
-                self.requirements[k] = min(v, self.requirements[k])
+                caps[k] = max(caps[k], v)
+        self.stack_caps = tuple(
+            (k, v) for k, v in sorted(caps.items()) if v > 0
+        )
+        self.index = {}
+        self._leaves = None
 
-    def generate(self, context):
-        children = list(self.children)
-        context.random.shuffle(children)
-        for child in children:
-            if isinstance(child, Language):
-                try:
-                    return child.generate(context)
-                except InapplicableLanguage:
-                    continue
+        # Sampling is uniform over the applicable children until any of them
+        # has a weight other than the default, after which we build an alias
+        # table for each set of candidates in tables. Children with a weight
+        # of zero are never chosen.
+        self.weights = [float(c.weight) for c in children]
+        self.uniform = _uniform(self.weights)
+        self.tables = {}
+
+    @property
+    def leaves(self):
+        """
+        A tuple of every Operation and PushRandom reachable from this
+        language, in a fixed depth first order. Steps of a program generated
+        from this language can be identified by their position in it.
+        """
+        if self._leaves is None:
+            leaves = []
+            for c in self.children:
+                if isinstance(c, ChooseFrom):
+                    leaves.extend(c.leaves)
+                else:
+                    leaves.append(c)
+            self._leaves = tuple(leaves)
+            self._leaf_indices = {}
+            for i, leaf in enumerate(reversed(self._leaves)):
+                self._leaf_indices[id(leaf)] = len(leaves) - 1 - i
+        return self._leaves
+
+    def encode(self, operation):
+        """
+        Return a pair of integers (index, seed) from which decode can rebuild
+        an operation generated by this language. Raises ValueError for
+        operations which did not come from this language.
+        """
+        self.leaves
+        if isinstance(operation, SeededPush):
+            leaf, seed = operation.source, operation.seed
+        else:
+            leaf, seed = operation, 0
+        try:
+            return self._leaf_indices[id(leaf)], seed
+        except KeyError:
+            raise ValueError("%r was not generated by this language" % (
+                operation,
+            ))
+
+    def decode(self, index, seed):
+        leaf = self.leaves[index]
+        if isinstance(leaf, PushRandom):
+            return SeededPush(leaf, seed)
+        return leaf
+
+    def scale(self, multiplier, offset=0):
+        """
+        Set the weight of each child to its own weight times
+        multiplier(start, end), where self.leaves[start:end] are the leaves
+        of that child, with indices shifted by offset. Children which are
+        themselves a ChooseFrom have their own children scaled in turn.
+        """
+        self.leaves
+        weights = []
+        start = offset
+        for c in self.children:
+            if isinstance(c, ChooseFrom):
+                end = start + len(c.leaves)
+                c.scale(multiplier, start)
             else:
-                if child.applicable(context):
-                    return child
+                end = start + 1
+            weights.append(float(c.weight) * multiplier(start, end))
+            start = end
+        if weights != self.weights:
+            self.weights = weights
+            self.uniform = _uniform(weights)
+            self.tables.clear()
+
+    def _key(self, context):
+        varstacks = context.varstacks
+        key = []
+        for k, cap in self.stack_caps:
+            varstack = varstacks.get(k)
+            height = 0 if varstack is None else len(varstack.data)
+            key.append(height if height < cap else cap)
+        return tuple(key)
+
+    def _positions(self, key):
+        heights = dict(zip(map(itemgetter(0), self.stack_caps), key))
+        return [
+            i for i, c in enumerate(self.children)
+            if all(
+                heights.get(k, 0) >= v for k, v in c.requirements.items()
+            )
+        ]
+
+    def candidates(self, context):
+        """
+        Return a tuple of the children whose requirements are satisfied by the
+        current stack heights of context. Children in the result may still
+        fail their precondition.
+        """
+        key = self._key(context)
+        try:
+            return self.index[key]
+        except KeyError:
+            pass
+        result = tuple(self.children[i] for i in self._positions(key))
+        self.index[key] = result
+        return result
+
+    def _table(self, context):
+        key = self._key(context)
+        try:
+            return self.tables[key]
+        except KeyError:
+            pass
+        positions = [i for i in self._positions(key) if self.weights[i] > 0]
+        weights = [self.weights[i] for i in positions]
+        table = (
+            tuple(self.children[i] for i in positions), weights,
+        ) + alias_table(weights)
+        self.tables[key] = table
+        return table
+
+    def generate(self, context):
+        if not self.uniform:
+            return self._generate_weighted(context)
+        # Picks uniformly at random among the children which are able to run,
+        # rejecting and retrying on any that turn out not to be.
+        candidates = self.candidates(context)
+        while candidates:
+            i = context.random.randrange(len(candidates))
+            result = _attempt(candidates[i], context)
+            if result is not None:
+                return result
+            candidates = candidates[:i] + candidates[i + 1:]
         raise InapplicableLanguage
 
+    def _generate_weighted(self, context):
+        # The first pick is made in constant time from an alias table. If it
+        # is rejected we fall back to a linear scan of the rest, which is no
+        # worse than rebuilding the table without it.
+        candidates, weights, probabilities, aliases = self._table(context)
+        if not candidates:
+            raise InapplicableLanguage
+        random = context.random
+        i = random.randrange(len(candidates))
+        if random.random() >= probabilities[i]:
+            i = aliases[i]
+        while True:
+            result = _attempt(candidates[i], context)
+            if result is not None:
+                return result
+            candidates = candidates[:i] + candidates[i + 1:]
+            weights = weights[:i] + weights[i + 1:]
+            if not candidates:
+                raise InapplicableLanguage
+            target = random.random() * sum(weights)
+            for i, weight in enumerate(weights):
+                target -= weight
+                if target < 0:
+                    break
+
+
+def _uniform(weights):
+    return len(set(weights)) <= 1 and all(w > 0 for w in weights)
+
+
+def _attempt(child, context):
+    """
+    Return an operation from child if it can run in context, else None.
+    """
+    if isinstance(child, Language):
+        try:
+            return child.generate(context)
+        except InapplicableLanguage:
+            return None
+    elif child.precondition is None or child.applicable(context):
+        return child
+    return None
+
+
+def alias_table(weights):
+    """
+    Build Vose's alias table for sampling from weights: a pair of lists
+    (probabilities, aliases) such that picking i uniformly at random, and
+    then replacing it with aliases[i] unless a uniform random number is
+    below probabilities[i], picks each i with probability proportional to
+    weights[i].
+    """
+    n = len(weights)
+    total = float(sum(weights))
+    if not n or total <= 0:
+        return [1.0] * n, list(range(n))
+    scaled = [w * n / total for w in weights]
+    probabilities = [1.0] * n
+    aliases = list(range(n))
+    small = [i for i, p in enumerate(scaled) if p < 1.0]
+    large = [i for i, p in enumerate(scaled) if p >= 1.0]
+    while small and large:
+        s = small.pop()
+        l = large.pop()
+        probabilities[s] = scaled[s]
+        aliases[s] = l
+        scaled[l] -= 1.0 - scaled[s]
+        if scaled[l] < 1.0:
+            small.append(l)
+        else:
+            large.append(l)
+    return probabilities, aliases
+
 
 class Dup(SingleStackOperation):
     min_height = 1
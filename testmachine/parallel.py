@@ -0,0 +1,412 @@
+"""
+Support for spreading the work of a testmachine across a pool of processes.
+
+Operations wrap arbitrary user functions (frequently lambdas), so neither
+machines nor the programs built from them can be pickled. Instead the machine
+is stashed in a module global before the pool is forked, and workers only
+ever exchange plain data with the parent: failing programs are sent back in
+the format of the serialization module, and candidates during minimization
+as lists of positions in the program being minimized.
+"""
+
+import multiprocessing
+import pickle
+import traceback
+from random import Random
+
+try:
+    from queue import Empty
+except ImportError:
+    from Queue import Empty
+
+from . import serialization
+from .operations import Language, PushRandom
+from .profiling import Profiler
+
+_machine = None
+_counts = None
+_base = None
+_stop = None
+_shortest = None
+
+PROGRAMS, OPERATIONS, FAILURES = range(3)
+
+# Kinds of message sent back to the parent by pipeline workers
+FOUND, SEARCHED, SKIPPED, MINIMIZED, ERROR = range(5)
+
+
+def _fork_context():
+    try:
+        return multiprocessing.get_context("fork")
+    except AttributeError:
+        # Python < 3.4 has no start methods and always forks on posix
+        return multiprocessing
+
+
+def split_iterations(n_iters, workers):
+    """
+    Divide n_iters as evenly as possible into workers shares. If n_iters is
+    None, meaning no limit, then so is every share.
+    """
+    if n_iters is None:
+        return [None] * workers
+    base, extra = divmod(n_iters, workers)
+    return [base + (1 if i < extra else 0) for i in range(workers)]
+
+
+class SharedStats(object):
+    """
+    Records each program a worker runs in counts shared with the parent, so
+    that it can report on the search as a whole while it runs.
+    """
+
+    def record(self, length, failed):
+        with _counts.get_lock():
+            _counts[PROGRAMS] += 1
+            _counts[OPERATIONS] += length
+            if failed:
+                _counts[FAILURES] += 1
+
+    def due(self):
+        return False
+
+
+def _reset_profiler(machine):
+    # Forked workers inherit whatever the parent had already recorded, so
+    # start afresh so that only new results are sent back to be merged.
+    if machine.profiler is not None:
+        machine.profiler = Profiler()
+
+
+def _profile(machine):
+    if machine.profiler is None:
+        return None
+    return machine.profiler.as_dict()
+
+
+def check_serializable(machine):
+    """
+    Raise ValueError if machine's language has a leaf which is a Language of
+    its own making rather than an operation or a generator. The operations
+    such a language generates cannot be serialized, so workers would have
+    no way to send back the programs they find.
+    """
+    for leaf in machine.language.leaves:
+        if isinstance(leaf, Language) and not isinstance(leaf, PushRandom):
+            raise ValueError((
+                "Workers cannot search languages which generate their own "
+                "operations, such as %r"
+            ) % (leaf,))
+
+
+def _search(args):
+    seed, n_iters = args
+    machine = _machine
+    _reset_profiler(machine)
+
+    def should_stop():
+        return _counts[FAILURES] >= machine.good_enough
+
+    best = None
+    for _, program in machine.failing_programs(
+        Random(seed), n_iters, should_stop=should_stop, stats=SharedStats()
+    ):
+        if best is None or len(program) < len(best):
+            best = program
+        if should_stop():
+            break
+    if best is not None:
+        best = (serialization.dumps(machine, best), len(best))
+    return best, _profile(machine)
+
+
+def find_failing_programs(machine, seeds, n_iters, stats):
+    """
+    Run machine.failing_programs in one process per entry in seeds, sharing
+    n_iters between them. All workers stop once machine.good_enough failures
+    have been found between them, so how far each one gets depends on how
+    fast the others are. While they run, stats is kept up to date and
+    reported whenever it is due.
+
+    Returns a list with one entry per worker, in the same order as seeds, of
+    either None or a pair (data, length) where data is the shortest failing
+    program that worker found, as serialized by serialization.dumps.
+    Anything the workers profiled is merged into machine.profiler.
+
+    Raises ValueError, before starting any workers, if the programs machine
+    generates cannot be serialized.
+    """
+    global _machine, _counts
+    check_serializable(machine)
+    context = _fork_context()
+    _machine = machine
+    _counts = context.Array('l', 3)
+    pool = context.Pool(len(seeds))
+    try:
+        result = pool.map_async(
+            _search, list(zip(seeds, split_iterations(n_iters, len(seeds))))
+        )
+        while not result.ready():
+            result.wait(stats.report_interval)
+            stats.programs, stats.operations, stats.failures = _counts[:]
+            if stats.failures and stats.first_failure is None:
+                # Only accurate to within the polling interval
+                stats.first_failure = stats.elapsed
+                stats.programs_to_first_failure = stats.programs
+            if stats.due():
+                machine.inform(str(stats))
+        results = []
+        for best, profile in result.get():
+            if profile is not None:
+                machine.profiler.merge(profile)
+            results.append(best)
+        return results
+    finally:
+        pool.terminate()
+        pool.join()
+        _machine = None
+        _counts = None
+
+
+def _error_message(e):
+    # The parent re-raises the exception a worker failed with, but the
+    # exception must be pickled to get it there, and the pickling happens
+    # in a background thread which swallows any errors.
+    try:
+        pickle.loads(pickle.dumps(e))
+        return (ERROR, e)
+    except Exception:
+        return (ERROR, RuntimeError(traceback.format_exc()))
+
+
+def _minimize(machine, data, messages):
+    if len(serialization.loads(machine, data)) > _shortest.value:
+        # A shorter failure has been queued or minimized since this one was
+        # queued, so this one is not worth minimizing.
+        messages.put((SKIPPED, None))
+        return
+    # Minimization resets the deadline, which we may be searching against.
+    deadline = machine.deadline
+    executions = machine.executions
+    try:
+        minimal = machine.minimize_failing_program(
+            serialization.loads(machine, data)
+        )
+    finally:
+        machine.deadline = deadline
+    with _shortest.get_lock():
+        if len(minimal) < _shortest.value:
+            _shortest.value = len(minimal)
+    messages.put((MINIMIZED, (
+        data, serialization.dumps(machine, minimal),
+        machine.executions - executions, _profile(machine),
+    )))
+    _reset_profiler(machine)
+
+
+def _pipeline_worker(seed, n_iters, tasks, messages):
+    machine = _machine
+    # A worker cannot start a pool of its own.
+    machine.workers = 1
+    _reset_profiler(machine)
+
+    def minimize_queued():
+        while True:
+            try:
+                data = tasks.get_nowait()
+            except Empty:
+                return
+            _minimize(machine, data, messages)
+
+    def should_stop():
+        minimize_queued()
+        return _stop.is_set() or _counts[FAILURES] >= machine.good_enough
+
+    try:
+        for _, program in machine.failing_programs(
+            Random(seed), n_iters, should_stop=should_stop, stats=SharedStats()
+        ):
+            # Only programs shorter than any found or minimized so far are
+            # worth minimizing, as the shortest failure usually shrinks
+            # furthest and it would be unusual for a program to shrink below
+            # one that has already been minimized.
+            with _shortest.get_lock():
+                if len(program) >= _shortest.value:
+                    continue
+                _shortest.value = len(program)
+            # The parent queues the program, so that it is always queued
+            # ahead of the sentinels the parent sends once searching ends.
+            messages.put((FOUND, serialization.dumps(machine, program)))
+        messages.put((SEARCHED, _profile(machine)))
+        _reset_profiler(machine)
+        while True:
+            data = tasks.get()
+            if data is None:
+                return
+            _minimize(machine, data, messages)
+    except Exception as e:
+        messages.put(_error_message(e))
+
+
+def pipeline(machine, seeds, n_iters, stats):
+    """
+    Search for failing programs in one process per entry in seeds, sharing
+    n_iters between them as find_failing_programs does, and minimize the
+    failures found as they are found.
+
+    Each failure shorter than every one found or minimized before it is sent
+    to the parent, which puts it on a queue shared by all the workers. They
+    take from it before each program they generate and once they have
+    finished searching. Anything on the queue which no longer meets that bar
+    when it is taken is skipped. So every process searches until there is
+    something to minimize, and the minimization of the best failure starts
+    as soon as it is found rather than after the search. The pipeline
+    finishes once the search is over and everything queued has been dealt
+    with, or as soon as a failure has been minimized to a single step as
+    that cannot be beaten. Only the parent puts anything on the queue, so
+    every failure is queued ahead of the sentinels telling workers to exit.
+
+    Returns None if nothing failed, else a tuple (original, minimal, count)
+    of the Program which minimized furthest, what it minimized to, and how
+    many programs were minimized in total. Executions and profiles from the
+    workers are added to machine's. Raises ValueError as
+    find_failing_programs does for programs which cannot be serialized.
+    """
+    global _machine, _counts, _stop, _shortest
+    check_serializable(machine)
+    context = _fork_context()
+    _machine = machine
+    _counts = context.Array('l', 3)
+    _stop = context.Event()
+    _shortest = context.Value('l', 2 ** 31 - 1)
+    messages = context.Queue()
+    tasks = context.Queue()
+    processes = [
+        context.Process(
+            target=_pipeline_worker, args=(seed, share, tasks, messages)
+        )
+        for seed, share in zip(seeds, split_iterations(n_iters, len(seeds)))
+    ]
+    try:
+        for process in processes:
+            process.daemon = True
+            process.start()
+        searching = len(seeds)
+        queued = 0
+        best = None
+        count = 0
+        while searching or queued:
+            try:
+                kind, value = messages.get(timeout=stats.report_interval)
+            except Empty:
+                kind = value = None
+            stats.programs, stats.operations, stats.failures = _counts[:]
+            if stats.due():
+                machine.inform(str(stats))
+            if kind == FOUND:
+                if stats.first_failure is None:
+                    stats.first_failure = stats.elapsed
+                    stats.programs_to_first_failure = stats.programs
+                tasks.put(value)
+                queued += 1
+            elif kind == SEARCHED:
+                searching -= 1
+                if value is not None:
+                    machine.profiler.merge(value)
+                if not searching:
+                    for _ in processes:
+                        tasks.put(None)
+            elif kind == SKIPPED:
+                queued -= 1
+            elif kind == MINIMIZED:
+                queued -= 1
+                count += 1
+                original, minimal, executions, profile = value
+                machine.executions += executions
+                if profile is not None:
+                    machine.profiler.merge(profile)
+                minimal = serialization.loads(machine, minimal)
+                if best is None or len(minimal) < len(best[1]):
+                    best = (serialization.loads(machine, original), minimal)
+                if len(minimal) <= 1:
+                    break
+            elif kind == ERROR:
+                raise value
+        stats.programs, stats.operations, stats.failures = _counts[:]
+        if best is None:
+            return None
+        return best + (count,)
+    finally:
+        _stop.set()
+        for process in processes:
+            if process.pid is not None:
+                process.terminate()
+                process.join()
+        _machine = None
+        _counts = None
+        _stop = None
+        _shortest = None
+
+
+def subsequence_positions(base, program):
+    """
+    Given a program whose steps are a subsequence of base, return the
+    positions in base of those steps. Where the same operation appears more
+    than once we take the earliest possible match, which makes no difference
+    to what the program does.
+    """
+    positions = []
+    i = 0
+    for operation in program:
+        while base[i] is not operation:
+            i += 1
+        positions.append(i)
+        i += 1
+    return positions
+
+
+def _evaluate(positions):
+    _reset_profiler(_machine)
+    program = [_base[i] for i in positions]
+    pruned, failed = _machine.prune_and_evaluate(program)
+    return subsequence_positions(_base, pruned), failed, _profile(_machine)
+
+
+class CandidatePool(object):
+    """
+    A pool of processes for evaluating candidate programs in parallel during
+    minimization. Every candidate must be a subsequence of base, which lets
+    us send it to the workers as a list of positions in base.
+    """
+
+    def __init__(self, machine, base, workers):
+        global _machine, _base
+        self.machine = machine
+        self.base = base
+        self.size = workers
+        _machine = machine
+        _base = base
+        try:
+            self.pool = _fork_context().Pool(workers)
+        finally:
+            _machine = None
+            _base = None
+
+    def evaluate(self, candidates):
+        """
+        Call prune_and_evaluate on each of candidates, returning a list of the
+        results in the same order.
+        """
+        results = self.pool.map(_evaluate, [
+            subsequence_positions(self.base, c) for c in candidates
+        ], 1)
+        evaluated = []
+        for positions, failed, profile in results:
+            if profile is not None:
+                self.machine.profiler.merge(profile)
+            evaluated.append(([self.base[i] for i in positions], failed))
+        return evaluated
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
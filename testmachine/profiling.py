@@ -0,0 +1,117 @@
+"""
+Collect timings of the operations a testmachine runs, to find out which of
+them dominate its running time.
+"""
+
+import json
+
+try:
+    from time import perf_counter as timer
+except ImportError:
+    from time import time as timer
+
+# Pseudo operation names under which time spent choosing operations rather
+# than running them is recorded.
+GENERATE = "<generate>"
+APPLICABLE = "<applicable>"
+
+
+class OperationStats(object):
+    __slots__ = ("calls", "total", "max", "exceptions")
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.exceptions = 0
+
+    def as_dict(self):
+        return {
+            "calls": self.calls,
+            "total": self.total,
+            "mean": self.total / self.calls if self.calls else 0.0,
+            "max": self.max,
+            "exceptions": self.exceptions,
+        }
+
+
+class Profiler(object):
+    """
+    Per operation name counts of calls, cumulative and maximum time in
+    seconds, and how many calls raised an exception.
+
+    RunContexts given a profiler record every operation they execute in it.
+    TestMachine additionally records the time it spends generating operations
+    under GENERATE and checking whether operations are applicable while
+    pruning under APPLICABLE.
+    """
+
+    def __init__(self):
+        self.stats = {}
+
+    def record(self, name, elapsed, failed=False):
+        try:
+            stats = self.stats[name]
+        except KeyError:
+            stats = OperationStats()
+            self.stats[name] = stats
+        stats.calls += 1
+        stats.total += elapsed
+        if elapsed > stats.max:
+            stats.max = elapsed
+        if failed:
+            stats.exceptions += 1
+
+    def call(self, name, function, *args):
+        """
+        Return function(*args), recording how long it took under name.
+        """
+        start = timer()
+        try:
+            result = function(*args)
+        except Exception:
+            self.record(name, timer() - start, failed=True)
+            raise
+        self.record(name, timer() - start)
+        return result
+
+    def merge(self, data):
+        """
+        Add in the results of another profiler, as returned by its as_dict.
+        """
+        for name, values in data.items():
+            try:
+                stats = self.stats[name]
+            except KeyError:
+                stats = OperationStats()
+                self.stats[name] = stats
+            stats.calls += values["calls"]
+            stats.total += values["total"]
+            stats.max = max(stats.max, values["max"])
+            stats.exceptions += values["exceptions"]
+
+    def as_dict(self):
+        return dict(
+            (name, stats.as_dict()) for name, stats in self.stats.items()
+        )
+
+    def to_json(self):
+        return json.dumps(self.as_dict(), sort_keys=True, indent=2)
+
+    def report(self):
+        """
+        A table of the results, slowest operation in total first.
+        """
+        lines = ["%-24s %10s %10s %10s %10s %10s" % (
+            "operation", "calls", "total(s)", "mean(us)", "max(us)",
+            "exceptions",
+        )]
+        for name, stats in sorted(
+            self.stats.items(), key=lambda item: -item[1].total
+        ):
+            lines.append("%-24s %10d %10.3f %10.1f %10.1f %10d" % (
+                name[:24], stats.calls, stats.total,
+                1e6 * stats.total / stats.calls, 1e6 * stats.max,
+                stats.exceptions,
+            ))
+        return "\n".join(lines)
@@ -0,0 +1,111 @@
+"""
+A compact representation of programs generated from a language.
+"""
+
+import hashlib
+from array import array
+
+from .operations import Language, PushRandom
+
+
+def language_fingerprint(language):
+    """
+    A short string identifying the structure of a ChooseFrom language: which
+    operations and generators it has, in what order, and the varstacks they
+    use. Encoded programs can be decoded by any language with the same
+    fingerprint. Changing the functions the operations call does not change
+    it.
+    """
+    description = []
+    for leaf in language.leaves:
+        if isinstance(leaf, PushRandom):
+            detail = repr(leaf.target)
+        elif isinstance(leaf, Language):
+            # Other languages have nothing to describe them but their type.
+            detail = ""
+        else:
+            detail = leaf.display()
+        description.append("%s:%s" % (type(leaf).__name__, detail))
+    return hashlib.sha1(
+        "\n".join(description).encode("utf-8")
+    ).hexdigest()[:16]
+
+
+class Program(object):
+    """
+    An immutable program generated from a ChooseFrom language, stored as a
+    flat array of integers holding an (index, seed) pair for each step as
+    produced by language.encode.
+
+    A list of live operations keeps a Push object alive for every generated
+    value, whereas this costs a couple of machine words per step. Iterating
+    over a Program decodes it back into operations, each Push regenerating
+    its value from its seed, so a Program can be passed anywhere that
+    expects a sequence of operations.
+
+    Programs generated in swarm mode record in enabled the sorted tuple of
+    indices of the leaves of language that generation was restricted to.
+    This is carried over to programs derived from them, but plays no part in
+    running them or in comparing them.
+    """
+
+    __slots__ = ("language", "steps", "enabled")
+
+    def __init__(self, language, steps, enabled=None):
+        self.language = language
+        self.steps = array('L', steps)
+        self.enabled = enabled
+
+    @classmethod
+    def from_operations(cls, language, operations, enabled=None):
+        """
+        Encode a sequence of operations generated by language. Raises
+        ValueError if any of them were not.
+        """
+        steps = array('L')
+        for operation in operations:
+            steps.extend(language.encode(operation))
+        return cls(language, steps, enabled)
+
+    def __len__(self):
+        return len(self.steps) // 2
+
+    def __iter__(self):
+        decode = self.language.decode
+        steps = self.steps
+        for i in range(0, len(steps), 2):
+            yield decode(steps[i], steps[i + 1])
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, stride = i.indices(len(self))
+            if stride != 1:
+                raise ValueError("Programs do not support extended slicing")
+            return Program(
+                self.language, self.steps[2 * start:2 * max(start, stop)],
+                self.enabled,
+            )
+        if i < 0:
+            i += len(self)
+        if not (0 <= i < len(self)):
+            raise IndexError("Program index out of range")
+        return self.language.decode(self.steps[2 * i], self.steps[2 * i + 1])
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, Program) and
+            self.language is other.language and
+            self.steps == other.steps
+        )
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(tuple(self.steps))
+
+    def __repr__(self):
+        return "Program(%s)" % (', '.join(
+            "%d:%d" % (self.steps[i], self.steps[i + 1])
+            for i in range(0, len(self.steps), 2)
+        ),)
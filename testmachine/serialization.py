@@ -0,0 +1,143 @@
+"""
+A portable binary format for programs, for saving them to disk or sending
+them between processes.
+
+A serialized program starts with a fixed size header:
+
+    magic       3 bytes    b"TMP"
+    version     1 byte     FORMAT_VERSION
+    fingerprint 8 bytes    the machine's fingerprint
+    width       1 byte     bytes per operation index: 1, 2 or 4
+    length      4 bytes    number of steps
+    enabled     4 bytes    number of enabled operations, or 0 for all
+
+followed by the operation index of each step, then the seed of each step as
+a 4 byte integer, then the index of each operation enabled in swarm mode.
+All integers are unsigned little endian. Keeping indices and seeds in
+separate blocks lets each be packed with a single struct call, and most
+languages have few enough operations that an index fits in a byte.
+
+A program can only be loaded by a machine with the same fingerprint as the
+one which dumped it, which is to say one built from the same operations in
+the same order, though the functions they call may have changed.
+"""
+
+import binascii
+import struct
+
+from .program import Program
+
+MAGIC = b"TMP"
+FORMAT_VERSION = 2
+
+_header = struct.Struct("<3sB8sBII")
+_frame = struct.Struct("<I")
+_widths = {1: "B", 2: "H", 4: "I"}
+
+
+class SerializationError(ValueError):
+    pass
+
+
+def _index_width(n_leaves):
+    if n_leaves <= 0x100:
+        return 1
+    elif n_leaves <= 0x10000:
+        return 2
+    return 4
+
+
+def dumps(machine, program):
+    """
+    Serialize program, which must have been generated by machine, to bytes.
+    """
+    program = machine.compress(program)
+    if not isinstance(program, Program):
+        raise SerializationError(
+            "Program contains operations not generated by this machine"
+        )
+    steps = program.steps
+    enabled = program.enabled or ()
+    n = len(steps) // 2
+    width = _index_width(len(machine.language.leaves))
+    index_format = _widths[width]
+    return b"".join((
+        _header.pack(
+            MAGIC, FORMAT_VERSION, binascii.unhexlify(machine.fingerprint),
+            width, n, len(enabled),
+        ),
+        struct.pack("<%d%s" % (n, index_format), *steps[0::2]),
+        struct.pack("<%dI" % (n,), *steps[1::2]),
+        struct.pack("<%d%s" % (len(enabled), index_format), *enabled),
+    ))
+
+
+def loads(machine, data):
+    """
+    Rebuild a Program for machine from the result of dumps. Raises
+    SerializationError if data is not a program for this machine.
+    """
+    if len(data) < _header.size:
+        raise SerializationError("Truncated program header")
+    magic, version, fingerprint, width, n, n_enabled = _header.unpack_from(
+        data
+    )
+    if magic != MAGIC:
+        raise SerializationError("Not a serialized program")
+    if version != FORMAT_VERSION:
+        raise SerializationError(
+            "Unsupported format version %d" % (version,)
+        )
+    if binascii.hexlify(fingerprint).decode("ascii") != machine.fingerprint:
+        raise SerializationError(
+            "Program was serialized by a different machine"
+        )
+    if width not in _widths:
+        raise SerializationError("Invalid index width %d" % (width,))
+    if len(data) != _header.size + n * (width + 4) + n_enabled * width:
+        raise SerializationError("Program data has the wrong length")
+    index_format = _widths[width]
+    indices = struct.unpack_from(
+        "<%d%s" % (n, index_format), data, _header.size
+    )
+    seeds = struct.unpack_from(
+        "<%dI" % (n,), data, _header.size + n * width
+    )
+    enabled = struct.unpack_from(
+        "<%d%s" % (n_enabled, index_format), data,
+        _header.size + n * (width + 4),
+    )
+    n_leaves = len(machine.language.leaves)
+    if max(indices + enabled + (0,)) >= n_leaves:
+        raise SerializationError("Operation index out of range")
+    steps = [None] * (2 * n)
+    steps[0::2] = indices
+    steps[1::2] = seeds
+    return Program(machine.language, steps, enabled or None)
+
+
+def dump(machine, program, stream):
+    """
+    Write program to a binary stream, prefixed with its length so that
+    several programs can be written to the same stream one after another.
+    """
+    data = dumps(machine, program)
+    stream.write(_frame.pack(len(data)))
+    stream.write(data)
+
+
+def load(machine, stream):
+    """
+    Read the next program written to stream by dump. Raises EOFError if
+    there are no more.
+    """
+    prefix = stream.read(_frame.size)
+    if not prefix:
+        raise EOFError()
+    if len(prefix) < _frame.size:
+        raise SerializationError("Truncated program length")
+    size, = _frame.unpack(prefix)
+    data = stream.read(size)
+    if len(data) < size:
+        raise SerializationError("Truncated program")
+    return loads(machine, data)
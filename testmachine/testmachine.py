@@ -1,15 +1,33 @@
 from random import Random
 from .operations import (
     ChooseFrom,
+    InapplicableLanguage,
+    PushRandom,
 )
-from collections import namedtuple, defaultdict
+from .parallel import find_failing_programs, pipeline, CandidatePool
+from .program import Program, language_fingerprint
+from .database import ExampleDatabase
+from . import serialization
+from .corpus import Corpus, program_features
+from .memory import FRAMES, MemoryTracker, is_tracing, stop_tracing
+from .mutation import mutate
+from .objectives import OBJECTIVES
+from .profiling import Profiler, GENERATE, APPLICABLE, timer
+from collections import namedtuple, defaultdict, OrderedDict
+from itertools import islice
+from multiprocessing.pool import ThreadPool
 import traceback
 import argparse
 
+try:
+    from time import monotonic as clock
+except ImportError:
+    from time import time as clock
+
 
 ProgramStep = namedtuple(
     "ProgramStep",
-    ("definitions", "arguments", "operation")
+    ("definitions", "arguments", "operation", "consumed")
 )
 
 Consume = namedtuple("Consume", ("varstack",))
@@ -19,6 +37,145 @@ def consume(varstack):
     return Consume(varstack)
 
 
+def dataflow_slice(log, conservative=False):
+    """
+    Given the log of a RunContext, return a list of booleans saying which of
+    its steps the final step depends on.
+
+    A step is kept if it defines a variable that a kept step reads, or if it
+    pops a variable that a kept step defined: removing the latter would leave
+    an extra value on the stack and shift what later steps read. Reads always
+    come off the top of a stack, so anything above a variable a kept step reads
+    is read by it too and the stacks of the sliced program line up with the
+    original.
+
+    Operations may also mutate the values they read, which the log cannot
+    see. If conservative is True then every step which reads a variable that
+    is still needed later is kept as well.
+    """
+    keep = [False] * len(log)
+    if not log:
+        return keep
+    needed = set()
+    defined = set()
+
+    def mark(i):
+        keep[i] = True
+        needed.update(log[i].arguments)
+        defined.update(log[i].definitions)
+
+    mark(len(log) - 1)
+    changed = True
+    while changed:
+        changed = False
+        for i in xrange(len(log) - 2, -1, -1):
+            if keep[i]:
+                continue
+            step = log[i]
+            if (
+                needed.intersection(step.definitions) or
+                (conservative and needed.intersection(step.arguments))
+            ):
+                mark(i)
+                changed = True
+        for i, step in enumerate(log):
+            if not keep[i] and defined.intersection(step.consumed):
+                mark(i)
+                changed = True
+    return keep
+
+
+class OutcomeCache(object):
+    """
+    A bounded record of whether programs fail, keyed on the identity of the
+    operations in them. When full the least recently used entry is evicted.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, key):
+        try:
+            result = self.data.pop(key)
+        except KeyError:
+            self.misses += 1
+            return None
+        self.data[key] = result
+        self.hits += 1
+        return result
+
+    def put(self, key, result):
+        self.data.pop(key, None)
+        self.data[key] = result
+        while len(self.data) > self.max_size:
+            self.data.popitem(last=False)
+
+    def clear(self):
+        self.data.clear()
+
+
+class SearchStats(object):
+    """
+    Running totals for a search, which report their throughput when
+    converted to a string. first_failure is how many seconds into the
+    search the first failing program was found, and programs_to_first_failure
+    how many programs had been run by then counting it, or both are None if
+    none has been.
+    """
+
+    def __init__(self, report_interval=None):
+        self.report_interval = report_interval
+        self.start = clock()
+        self.last_report = self.start
+        self.programs = 0
+        self.operations = 0
+        self.failures = 0
+        self.first_failure = None
+        self.programs_to_first_failure = None
+
+    def record(self, length, failed):
+        self.programs += 1
+        self.operations += length
+        if failed:
+            self.failures += 1
+            if self.first_failure is None:
+                self.first_failure = self.elapsed
+                self.programs_to_first_failure = self.programs
+
+    def due(self):
+        """
+        Returns True at most once every report_interval seconds.
+        """
+        if self.report_interval is None:
+            return False
+        now = clock()
+        if now - self.last_report < self.report_interval:
+            return False
+        self.last_report = now
+        return True
+
+    @property
+    def elapsed(self):
+        return clock() - self.start
+
+    def __str__(self):
+        elapsed = max(self.elapsed, 1e-6)
+        return (
+            "%d programs (%.0f/s), %d operations (%.0f/s), "
+            "%d failures in %.1fs"
+        ) % (
+            self.programs, self.programs / elapsed,
+            self.operations, self.operations / elapsed,
+            self.failures, elapsed,
+        )
+
+
 class TestMachineError(Exception):
     pass
 
@@ -27,79 +184,258 @@ class NoFailingProgram(TestMachineError):
     pass
 
 
+class LatencyBudgetExceeded(TestMachineError):
+    """
+    Raised when an operation completes but takes longer than its latency
+    budget, which makes the step that ran it fail like any other.
+    """
+
+    def __init__(self, name, elapsed, budget):
+        super(LatencyBudgetExceeded, self).__init__(
+            "%s took %.3fms, over its budget of %.3fms" % (
+                name, 1000 * elapsed, 1000 * budget,
+            )
+        )
+        self.name = name
+        self.elapsed = elapsed
+        self.budget = budget
+
+
+class MemoryGrowthExceeded(TestMachineError):
+    """
+    Raised when the memory a program has retained since it started grows
+    past the threshold set, which makes the step it was detected at fail.
+    """
+
+    def __init__(self, growth, steps, lines):
+        super(MemoryGrowthExceeded, self).__init__(
+            "Memory grew by %d bytes over %d steps. Largest growth was "
+            "allocated at:\n%s" % (growth, steps, "\n".join(lines))
+        )
+        self.growth = growth
+        self.steps = steps
+        self.lines = lines
+
+
+def variable_name(var):
+    """
+    Variables are identified by integers while running, and only given names
+    when a log is compiled for output.
+    """
+    return "t%d" % (var,)
+
+
 class VarStack(object):
+    __slots__ = ("name", "context", "data", "names")
+
     def __init__(self, name, context):
         self.name = name
         self.context = context
         self.data = []
         self.names = []
-        self.frozen = False
-
-    def _integrity_check(self):
-        assert len(self.data) == len(self.names)
 
     def pop(self, i=0):
         i = -1 - i
-        self._integrity_check()
         result = self.data[i]
-        self.context.on_read(self.names[i])
+        self.context.on_consume(self.names[i])
         del self.data[i]
         del self.names[i]
         return result
 
     def push(self, head):
-        self._integrity_check()
         self.data.append(head)
         v = self.context.newvar()
         self.names.append(v)
         self.context.on_write(v)
 
     def dup(self):
-        self._integrity_check()
-        self.names.append(self.names[-1])
+        v = self.names[-1]
+        self.context.on_read(v)
+        self.names.append(v)
         self.data.append(self.data[-1])
+        self.context.on_write(v)
 
     def peek(self, index=0):
-        self._integrity_check()
         i = -1 - index
         self.context.on_read(self.names[i])
         return self.data[i]
 
     def has(self, count):
-        self._integrity_check()
         return len(self.data) >= count
 
 
+class CheckedVarStack(VarStack):
+    """
+    A VarStack which checks its internal consistency before every operation.
+    Used by RunContexts in debug mode.
+    """
+    __slots__ = ()
+
+    def _integrity_check(self):
+        assert len(self.data) == len(self.names)
+
+    def pop(self, i=0):
+        self._integrity_check()
+        return super(CheckedVarStack, self).pop(i)
+
+    def push(self, head):
+        self._integrity_check()
+        super(CheckedVarStack, self).push(head)
+
+    def dup(self):
+        self._integrity_check()
+        super(CheckedVarStack, self).dup()
+
+    def peek(self, index=0):
+        self._integrity_check()
+        return super(CheckedVarStack, self).peek(index)
+
+    def has(self, count):
+        self._integrity_check()
+        return super(CheckedVarStack, self).has(count)
+
+
+class UntracedVarStack(VarStack):
+    """
+    A VarStack which only keeps values, without naming them or reporting
+    reads and writes to its context. Used by untraced RunContexts.
+    """
+    __slots__ = ()
+
+    def pop(self, i=0):
+        return self.data.pop(-1 - i)
+
+    def push(self, head):
+        self.data.append(head)
+
+    def dup(self):
+        self.data.append(self.data[-1])
+
+    def peek(self, index=0):
+        return self.data[-1 - index]
+
+
 class RunContext(object):
-    def __init__(self, random=None):
+    """
+    The state of a single run of a program.
+
+    By default a context traces every step into self.log, recording which
+    variables it read and wrote, which is what lets us print programs and
+    slice them. When trace is False nothing is recorded and the log stays
+    empty, which is all we need when we only care whether a program fails.
+
+    If a Profiler is given then the time taken by every operation executed is
+    recorded in it.
+
+    Operations with a latency budget, or every operation if latency_budget is
+    given here, are timed and raise LatencyBudgetExceeded if they take longer
+    than it in seconds. An operation's own budget takes precedence.
+
+    If a MemoryTracker is given as memory then each step executed is counted
+    by it, and raises MemoryGrowthExceeded whenever it reports that the
+    program has retained too much.
+    """
+
+    __slots__ = (
+        "random", "varstacks", "var_index", "log", "varstack_class",
+        "values_read", "values_written", "values_consumed", "trace",
+        "profiler", "latency_budget", "memory",
+    )
+
+    def __init__(
+        self, random=None, debug=False, trace=True, profiler=None,
+        latency_budget=None, memory=None,
+    ):
         self.random = random or Random()
+        self.profiler = profiler
+        self.latency_budget = latency_budget
+        self.memory = memory
         self.varstacks = {}
         self.var_index = 0
         self.reset_tracking()
         self.log = []
+        self.trace = trace
+        if not trace:
+            self.varstack_class = UntracedVarStack
+        elif debug:
+            self.varstack_class = CheckedVarStack
+        else:
+            self.varstack_class = VarStack
 
     def reset_tracking(self):
         self.values_read = []
         self.values_written = []
+        self.values_consumed = []
 
     def run_program(self, program):
         for operation in program:
             self.execute(operation)
 
     def execute(self, operation):
+        budget = self.latency_budget_for(operation)
+        if budget is not None:
+            self._execute_within(operation, budget)
+        elif self.profiler is not None:
+            self.profiler.call(operation.name, self._execute, operation)
+        elif not self.trace:
+            operation.invoke(self)
+        else:
+            self._execute(operation)
+        if self.memory is not None:
+            growth = self.memory.step()
+            if growth is not None:
+                raise MemoryGrowthExceeded(
+                    growth[0], self.memory.steps, growth[1]
+                )
+
+    def latency_budget_for(self, operation):
+        """
+        The most seconds operation may take in this context, or None.
+        """
+        budget = operation.latency_budget
+        if budget is None:
+            budget = self.latency_budget
+        return budget
+
+    def check_latency(self, operation, elapsed):
+        """
+        Raise LatencyBudgetExceeded if operation taking elapsed seconds is
+        over its budget in this context. Operations which do some of their
+        work ahead of being executed use this to count the time it took.
+        """
+        budget = self.latency_budget_for(operation)
+        if budget is not None and elapsed > budget:
+            raise LatencyBudgetExceeded(operation.name, elapsed, budget)
+
+    def _execute_within(self, operation, budget):
+        start = timer()
+        if self.profiler is not None:
+            self.profiler.call(operation.name, self._execute, operation)
+        else:
+            self._execute(operation)
+        elapsed = timer() - start
+        if elapsed > budget:
+            raise LatencyBudgetExceeded(operation.name, elapsed, budget)
+
+    def _execute(self, operation):
+        if not self.trace:
+            operation.invoke(self)
+            return
         self.reset_tracking()
         try:
             operation.invoke(self)
             self.log.append(ProgramStep(
                 operation=operation,
                 definitions=tuple(self.values_written),
-                arguments=tuple(self.values_read)
+                arguments=tuple(self.values_read),
+                consumed=tuple(self.values_consumed),
             ))
         except Exception:
             self.log.append(ProgramStep(
                 operation=operation,
                 definitions=(),
-                arguments=tuple(self.values_read)
+                arguments=tuple(self.values_read),
+                consumed=tuple(self.values_consumed),
             ))
             raise
 
@@ -113,7 +449,7 @@ class RunContext(object):
 
     def newvar(self):
         self.var_index += 1
-        return "t%d" % (self.var_index,)
+        return self.var_index
 
     def on_read(self, var):
         self.values_read.append(var)
@@ -121,13 +457,17 @@ class RunContext(object):
     def on_write(self, var):
         self.values_written.append(var)
 
+    def on_consume(self, var):
+        self.values_read.append(var)
+        self.values_consumed.append(var)
+
     def varstack(self, name):
         if isinstance(name, Consume):
             name = name.varstack
         try:
             return self.varstacks[name]
         except KeyError:
-            varstack = VarStack(name, self)
+            varstack = self.varstack_class(name, self)
             self.varstacks[name] = varstack
             return varstack
 
@@ -146,18 +486,98 @@ class RunContext(object):
 
 
 class TestMachine(object):
+    # In adaptive mode, how much more likely operations which have failed are
+    # to be generated
+    adaptive_limit = 20.0
+
+    # In swarm mode, the chance of each operation being enabled for a program
+    swarm_probability = 0.5
+
+    # When maximizing an objective, how many of the costliest programs found
+    # so far to keep and mutate
+    elite_size = 10
+
+    # When maximizing an objective with no cost_threshold, programs are shrunk
+    # while they keep at least this fraction of the highest cost found
+    cost_fraction = 0.5
+
+    # When maximizing an objective, how many times to run the costliest
+    # program found again before shrinking it, taking the median of those
+    # costs as its cost. Noisy costs such as wall time make the highest
+    # found an overestimate, as it is the luckiest of many runs.
+    cost_samples = 5
+
+    # In corpus mode, the most programs to keep in the corpus
+    corpus_size = 500
+
+    # In corpus mode, the chance of each program starting from a mutation of
+    # one in the corpus rather than being generated from scratch
+    mutation_probability = 0.75
+
     def __init__(
         self,
         n_iters=500,
         prog_length=200,
         good_enough=10,
         print_output=True,
+        workers=1,
+        seed=None,
+        minimizer="ddmin",
+        cache_size=10000,
+        debug=False,
+        time_budget=None,
+        minimize_budget=None,
+        report_interval=5.0,
+        profile=False,
+        database=None,
+        adaptive=False,
+        swarm=False,
+        pipeline=False,
+        concurrency=1,
+        latency_budget=None,
+        latency_reruns=0,
+        objective=None,
+        cost_threshold=None,
+        memory_growth=None,
+        memory_interval=10,
+        corpus=False,
     ):
         self.languages = []
+        self._language = None
+        self._fingerprint = None
         self.n_iters = n_iters
         self.prog_length = prog_length
         self.good_enough = good_enough
         self.print_output = print_output
+        self.workers = workers
+        self.seed = seed
+        self.minimizer = minimizer
+        self.executions = 0
+        self.outcomes = OutcomeCache(cache_size)
+        self.candidate_pool = None
+        self.debug = debug
+        self.time_budget = time_budget
+        self.minimize_budget = minimize_budget
+        self.report_interval = report_interval
+        self.deadline = None
+        self.search_stats = None
+        self.profiler = Profiler() if profile else None
+        self.profile_json = None
+        self.database = database
+        self.adaptive = adaptive
+        self.operation_failures = []
+        self.swarm = swarm
+        self.enabled = None
+        self.pipeline = pipeline
+        self.concurrency = concurrency
+        self.latency_budget = latency_budget
+        self.latency_reruns = latency_reruns
+        self.objective = objective
+        self.cost_threshold = cost_threshold
+        self.minimum_cost = None
+        self.memory_growth = memory_growth
+        self.memory_interval = memory_interval
+        self.corpus = corpus
 
     def inform(self, message):
         if self.print_output:
@@ -182,28 +602,200 @@ class TestMachine(object):
             type=int, default=self.n_iters,
             help="Number of iterations to run",
         )
+        parser.add_argument(
+            "-j", "--workers",
+            type=int, default=self.workers,
+            help="Number of processes to search with",
+        )
+        parser.add_argument(
+            "-s", "--seed",
+            type=int, default=self.seed,
+            help="Seed for the random number generator",
+        )
+        parser.add_argument(
+            "-m", "--minimizer",
+            choices=sorted(MINIMIZERS), default=self.minimizer,
+            help="Strategy used to shrink failing programs",
+        )
+        parser.add_argument(
+            "--time-budget",
+            type=float, default=self.time_budget,
+            help=(
+                "Seconds to search for. Replaces the limit on iterations"
+            ),
+        )
+        parser.add_argument(
+            "--minimize-budget",
+            type=float, default=self.minimize_budget,
+            help="Seconds to spend minimizing a failing program",
+        )
+        parser.add_argument(
+            "--database", metavar="DIR", default=self.database,
+            help=(
+                "Directory in which to keep failing programs to replay on "
+                "the next run"
+            ),
+        )
+        parser.add_argument(
+            "--adaptive", action="store_true", default=self.adaptive,
+            help=(
+                "Favour operations which have already caused a failure"
+            ),
+        )
+        parser.add_argument(
+            "--swarm", action="store_true", default=self.swarm,
+            help=(
+                "Generate each program from a random subset of the operations"
+            ),
+        )
+        parser.add_argument(
+            "--pipeline", action="store_true", default=self.pipeline,
+            help=(
+                "Minimize failing programs in parallel with the search for "
+                "more of them"
+            ),
+        )
+        parser.add_argument(
+            "-c", "--concurrency",
+            type=int, default=self.concurrency,
+            help=(
+                "Number of programs to run at once in threads, so that "
+                "operations which await coroutines can overlap their waits"
+            ),
+        )
+        parser.add_argument(
+            "--latency-budget", metavar="SECONDS",
+            type=float, default=self.latency_budget,
+            help=(
+                "Fail any operation which takes longer than this and has no "
+                "budget of its own"
+            ),
+        )
+        parser.add_argument(
+            "--latency-reruns",
+            type=int, default=self.latency_reruns,
+            help=(
+                "Number of times a program must exceed a latency budget "
+                "again before it counts as failing, to rule out noise"
+            ),
+        )
+        parser.add_argument(
+            "--objective",
+            choices=sorted(OBJECTIVES), default=None,
+            help=(
+                "Instead of looking for a failing program, look for the one "
+                "which costs the most by this measure"
+            ),
+        )
+        parser.add_argument(
+            "--cost-threshold",
+            type=float, default=self.cost_threshold,
+            help=(
+                "Cost which programs must keep while they are minimized "
+                "when searching with an objective"
+            ),
+        )
+        parser.add_argument(
+            "--memory-growth", metavar="BYTES",
+            type=int, default=self.memory_growth,
+            help=(
+                "Fail any program which retains more than this much memory "
+                "while it runs, as traced by tracemalloc"
+            ),
+        )
+        parser.add_argument(
+            "--memory-interval", metavar="STEPS",
+            type=int, default=self.memory_interval,
+            help=(
+                "Number of steps between checks of memory growth while "
+                "searching for programs which fail them"
+            ),
+        )
+        parser.add_argument(
+            "--corpus", action="store_true", default=self.corpus,
+            help=(
+                "Build programs by mutating earlier ones which did something "
+                "new, as well as from scratch"
+            ),
+        )
+        parser.add_argument(
+            "--profile", action="store_true", default=False,
+            help="Report the time spent in each operation at the end",
+        )
+        parser.add_argument(
+            "--profile-json", metavar="FILE",
+            help="Also write the profile as JSON to FILE",
+        )
 
         results = parser.parse_args(args)
         self.prog_length = results.program_length
+        self.workers = results.workers
+        self.seed = results.seed
+        self.minimizer = results.minimizer
+        self.time_budget = results.time_budget
+        self.minimize_budget = results.minimize_budget
+        if results.profile or results.profile_json:
+            self.profiler = Profiler()
+        self.profile_json = results.profile_json
+        self.database = results.database
+        self.adaptive = results.adaptive
+        self.swarm = results.swarm
+        self.pipeline = results.pipeline
+        self.concurrency = results.concurrency
+        self.latency_budget = results.latency_budget
+        self.latency_reruns = results.latency_reruns
+        if results.objective is not None:
+            self.objective = OBJECTIVES[results.objective]()
+        self.cost_threshold = results.cost_threshold
+        self.memory_growth = results.memory_growth
+        self.memory_interval = results.memory_interval
+        self.corpus = results.corpus
         if results.trial_run:
             self.trial_run()
         else:
             self.n_iters = results.iterations
             self.run()
 
+    def new_context(self, random=None, trace=True, memory_interval=1):
+        """
+        Create a RunContext to run this machine's programs in. Searching and
+        minimizing only need to know whether a program fails, so they pass
+        trace=False and leave it to run() to replay the final program with
+        tracing on.
+
+        If self.memory_growth is set then the context checks the memory the
+        program retains every memory_interval steps. Only generate_program
+        checks less often than every step, to keep the search fast, so that
+        minimized programs stop at the step that takes them over and fail
+        again whenever they are run. Only traced contexts record the full
+        traceback of allocations, as that slows everything down.
+        """
+        memory = None
+        if self.memory_growth is not None:
+            memory = MemoryTracker(
+                self.memory_growth, memory_interval, FRAMES if trace else 1
+            )
+        return RunContext(
+            random=random, debug=self.debug, trace=trace,
+            profiler=self.profiler, latency_budget=self.latency_budget,
+            memory=memory,
+        )
+
     def print_execution_log(self, context):
         for step in context.log:
             statements = step.operation.compile(
-                arguments=step.arguments, results=step.definitions
+                arguments=list(map(variable_name, step.arguments)),
+                results=list(map(variable_name, step.definitions)),
             )
             for statement in statements:
                 self.inform(statement)
 
     def trial_run(self):
-        context = RunContext()
+        context = self.new_context(random=Random(self.seed))
+        language = self.language
         try:
             for _ in xrange(self.prog_length):
-                operation = self.language.generate(context)
+                operation = language.generate(context)
                 context.execute(operation)
         finally:
             self.print_execution_log(context)
@@ -217,13 +809,58 @@ class TestMachine(object):
         If self.print_output is True then this will print a nice representation
         of the group to stdout and the exception generated by the failure.
         """
+        tracing = is_tracing()
         try:
-            first_try = self.find_failing_program()
-        except NoFailingProgram as e:
-            self.inform(str(e))
-            return
-        minimal = self.minimize_failing_program(first_try)
-        context = RunContext()
+            if self.objective is not None:
+                return self.run_objective()
+            return self.run_search()
+        finally:
+            self.finish_tracing(tracing)
+
+    def run_search(self):
+        """
+        run this testmachine in search of a failing program, as run does when
+        there is no objective.
+        """
+        self.outcomes.hits = self.outcomes.misses = 0
+        generator_calls = self.generator_calls
+        database = None
+        if self.database is not None:
+            database = ExampleDatabase(self.database)
+        first_try = replayed = minimal = None
+        if database is not None:
+            first_try = replayed = self.replay_database(database)
+        if first_try is None:
+            try:
+                if self.pipeline:
+                    first_try, minimal = self.search_and_minimize()
+                else:
+                    first_try = self.find_failing_program()
+            except NoFailingProgram as e:
+                self.inform(str(e))
+                self.report_profile()
+                return
+        if getattr(first_try, "enabled", None) is not None:
+            self.inform("Found with %d of %d operations enabled" % (
+                len(first_try.enabled), len(self.language.leaves),
+            ))
+        if minimal is None:
+            executions = self.executions
+            start = clock()
+            minimal = self.minimize_failing_program(first_try)
+            self.inform(
+                "Minimized from %d to %d steps with %d executions in %.1fs" % (
+                    len(first_try), len(minimal),
+                    self.executions - executions, clock() - start,
+                )
+            )
+        if database is not None and isinstance(minimal, Program):
+            if replayed is not None and replayed != minimal:
+                database.delete(
+                    self.fingerprint, serialization.dumps(self, replayed)
+                )
+            database.save(self.fingerprint, serialization.dumps(self, minimal))
+        context = self.new_context()
         try:
             context.run_program(minimal)
         except Exception:
@@ -237,89 +874,930 @@ class TestMachine(object):
             except Exception:
                 traceback.print_exc()
 
+        self.inform("Outcome cache: %d hits, %d misses" % (
+            self.outcomes.hits, self.outcomes.misses
+        ))
+        self.inform("Generator calls: %d" % (
+            self.generator_calls - generator_calls,
+        ))
+        self.report_profile()
         return context
 
+    def run_objective(self):
+        """
+        run this testmachine in search of a program which costs as much as
+        possible by self.objective, then shrink it to a shorter program whose
+        cost is still at least self.cost_threshold. Returns None if no
+        program reaches the threshold, else a RunContext which has run the
+        shrunk program.
+        """
+        best, highest = self.maximize_cost()
+        cost = _median([
+            self.measure_cost(best)[1] for _ in xrange(self.cost_samples)
+        ])
+        threshold = self.cost_threshold
+        if threshold is None:
+            threshold = self.cost_fraction * cost
+        unit = self.objective.unit
+        self.inform((
+            "Highest cost %g%s, from a program of %d steps which costs "
+            "%g%s when run again"
+        ) % (highest, unit, len(best), cost, unit))
+        if cost < threshold:
+            self.inform("No program reached a cost of %g%s" % (
+                threshold, unit,
+            ))
+            self.report_profile()
+            return None
+        executions = self.executions
+        start = clock()
+        self.minimum_cost = threshold
+        try:
+            minimal = self.minimize_failing_program(best)
+        finally:
+            self.minimum_cost = None
+        self.inform(
+            "Minimized from %d to %d steps costing at least %g%s with %d "
+            "executions in %.1fs" % (
+                len(best), len(minimal), threshold, unit,
+                self.executions - executions, clock() - start,
+            )
+        )
+        context = self.new_context()
+        self.objective.start()
+        try:
+            context.run_program(minimal)
+        except Exception:
+            pass
+        cost = self.objective.finish(context)
+        self.print_execution_log(context)
+        self.inform("Cost: %g%s" % (cost, unit))
+        self.report_profile()
+        return context
+
+    def replay_database(self, database):
+        """
+        Run every program saved in database for this machine, returning the
+        first which still fails, or None if none do. Programs which no longer
+        fail, or which can no longer be decoded, are deleted.
+        """
+        key = self.fingerprint
+        for data in database.fetch(key):
+            try:
+                program = serialization.loads(self, data)
+            except serialization.SerializationError:
+                database.delete(key, data)
+                continue
+            if self.program_fails(program):
+                self.inform("Replayed a saved failing program")
+                return program
+            database.delete(key, data)
+        return None
+
+    def report_profile(self):
+        if self.profiler is None:
+            return
+        self.inform(self.profiler.report())
+        if self.profile_json:
+            with open(self.profile_json, "w") as f:
+                f.write(self.profiler.to_json())
+
     def add(self, *languages):
         self.languages.extend(languages)
+        self._language = None
+        self._fingerprint = None
+
+    @property
+    def generator_calls(self):
+        """
+        The total number of values produced by generators in this machine's
+        language, in this process, so far.
+        """
+        return sum(
+            leaf.calls for leaf in self.language.leaves
+            if isinstance(leaf, PushRandom)
+        )
 
     @property
     def language(self):
-        return ChooseFrom(self.languages)
+        """
+        The Language formed by choosing from everything added to this machine.
+
+        Compiling this is relatively expensive, so it is built on first use
+        and reused until add() is next called.
+        """
+        if self._language is None:
+            self._language = ChooseFrom(self.languages)
+        return self._language
+
+    @property
+    def fingerprint(self):
+        """
+        Identifies the structure of this machine's language, so that programs
+        saved by one machine are only loaded by another with the same
+        operations in the same order.
+        """
+        if self._fingerprint is None:
+            self._fingerprint = language_fingerprint(self.language)
+        return self._fingerprint
+
+    def generate_program(self, random, enabled=None):
+        """
+        Generate and execute a single program of up to self.prog_length steps,
+        drawing all randomness from random. Returns a pair (program, failed)
+        where program stops at the first step that raised an exception.
+
+        If enabled is given only the leaves of self.language at those indices
+        are generated, and the program stops early if none of them can run.
+
+        Programs are a deterministic function of the state of random and of
+        enabled, so calling this again with an identically seeded Random will
+        rebuild the same program.
+        """
+        self.enable(enabled)
+        program, error = self.explore_program(random, enabled=enabled)
+        return program, error is not None
+
+    def explore_program(self, random, base=(), enabled=None, depths=None):
+        """
+        Run the steps of base, skipping any which are not applicable when they
+        are reached, then carry on generating steps from random until the
+        program is self.prog_length steps long or a step fails. Returns a
+        pair (program, error) of the steps that were run and the exception
+        the last of them raised or None. Generation is restricted to enabled
+        as in generate_program, which is this with no base.
+
+        If depths is given it is a dict which is updated with the most values
+        each varstack held at once.
+        """
+        context = self.new_context(
+            random=random, trace=False, memory_interval=self.memory_interval
+        )
+        language = self.language
+        profiler = self.profiler
+        program = []
+        steps = iter(base)
+        while len(program) < self.prog_length:
+            operation = next(steps, None)
+            if operation is not None:
+                if not operation.applicable(context):
+                    continue
+            else:
+                try:
+                    if profiler is None:
+                        operation = language.generate(context)
+                    else:
+                        operation = profiler.call(
+                            GENERATE, language.generate, context
+                        )
+                except InapplicableLanguage:
+                    if enabled is None:
+                        raise
+                    break
+            program.append(operation)
+            try:
+                context.execute(operation)
+            except LatencyBudgetExceeded as e:
+                if self.too_slow(program):
+                    return program, e
+            except Exception as e:
+                return program, e
+            if depths is not None:
+                for name, varstack in context.varstacks.items():
+                    depth = len(varstack.data)
+                    if depth > depths.get(name, 0):
+                        depths[name] = depth
+        return program, None
+
+    def iterations(self, n_iters, should_stop=None, batch=1):
+        """
+        Yield the number of programs in each batch of up to batch programs
+        that a search should run, until n_iters have been run if it is not
+        None, should_stop returns True, or we are out of time.
+        """
+        i = 0
+        while n_iters is None or i < n_iters:
+            if should_stop is not None and should_stop():
+                return
+            if self.out_of_time():
+                return
+            size = batch if n_iters is None else min(batch, n_iters - i)
+            i += size
+            yield size
+
+    def record_program(self, program, failed, stats):
+        """
+        Learn from a program a search has just run, whether or not it failed,
+        by adapting weights if self.adaptive is set and recording it in stats
+        if that is not None.
+        """
+        if self.adaptive:
+            self.adapt(program, failed)
+        if stats is not None:
+            stats.record(len(program), failed)
+            if stats.due():
+                self.inform(str(stats))
+
+    def failing_programs(self, random, n_iters, should_stop=None, stats=None):
+        """
+        Generate n_iters programs, or as many as fit before self.deadline if
+        n_iters is None, yielding a pair (seed, program) for each one that
+        fails, where program is as returned by compress. Unless self.adaptive
+        is set the program may be rebuilt by passing Random(seed) and the
+        leaves it was generated from to generate_program.
+
+        If self.swarm is set then each program is generated from a different
+        random subset of the operations, chosen by choose_swarm.
+
+        If self.concurrency is more than one then programs are generated in
+        batches of that many, each in its own thread, so that operations
+        which wait on coroutines overlap their waits. The programs generated
+        and the order in which they are yielded are the same as when they are
+        generated one at a time. This cannot be combined with swarm mode or
+        with tracking memory growth.
+
+        If self.corpus is set then programs come from corpus_failing_programs
+        instead, and cannot be rebuilt from their seed, which is None.
+
+        If should_stop is provided it is called before each iteration and the
+        search ends early once it returns True. If stats is provided, every
+        program is recorded in it and it is reported whenever it is due.
+        """
+        if self.corpus:
+            for result in self.corpus_failing_programs(
+                random, n_iters, should_stop, stats
+            ):
+                yield result
+            return
+        pool = None
+        if self.concurrency > 1:
+            if self.swarm:
+                raise ValueError("Swarm mode cannot be used with concurrency")
+            if self.memory_growth is not None:
+                raise ValueError(
+                    "Memory growth cannot be tracked with concurrency"
+                )
+            pool = ThreadPool(self.concurrency)
+        try:
+            for batch in self.iterations(
+                n_iters, should_stop, 1 if pool is None else self.concurrency
+            ):
+                seeds = [random.getrandbits(64) for _ in xrange(batch)]
+                enabled = None
+                if pool is None:
+                    if self.swarm:
+                        # A separate draw, as choosing the subset from the
+                        # same stream as the program would correlate the two.
+                        enabled = self.choose_swarm(
+                            Random(random.getrandbits(64))
+                        )
+                    results = [
+                        self.generate_program(Random(seeds[0]), enabled)
+                    ]
+                else:
+                    results = pool.map(self._generate_from_seed, seeds)
+                for seed, (program, failed) in zip(seeds, results):
+                    self.record_program(program, failed, stats)
+                    if failed:
+                        yield seed, self.compress(program, enabled)
+        finally:
+            if pool is not None:
+                pool.terminate()
+
+    def corpus_failing_programs(self, random, n_iters, should_stop, stats):
+        """
+        As failing_programs, but keeping a Corpus of up to self.corpus_size
+        programs which did something new, as told by their program_features.
+        With probability self.mutation_probability each program starts from
+        a mutation of one in the corpus, which explore_program runs as far as
+        it can before carrying on with freshly generated steps. Otherwise it
+        is generated from scratch.
+
+        Everything the search learns is kept in memory by the corpus, so that
+        deep states reached once can be built on rather than having to be
+        found again by chance.
+        """
+        if self.swarm or self.concurrency > 1:
+            raise ValueError(
+                "Corpus mode cannot be used with swarm mode or concurrency"
+            )
+        corpus = Corpus(self.corpus_size)
+        for _ in self.iterations(n_iters, should_stop):
+            base = ()
+            if len(corpus) and random.random() < self.mutation_probability:
+                base = mutate(
+                    random, corpus.choose(random), [corpus.choose(random)],
+                    self.prog_length,
+                )
+            depths = {}
+            program, error = self.explore_program(
+                Random(random.getrandbits(64)), base, depths=depths
+            )
+            failed = error is not None
+            self.record_program(program, failed, stats)
+            program = self.compress(program)
+            if isinstance(program, Program):
+                corpus.add(program, program_features(program, error, depths))
+            if failed:
+                yield None, program
+
+    def _generate_from_seed(self, seed):
+        return self.generate_program(Random(seed))
+
+    def choose_swarm(self, random):
+        """
+        Return a sorted tuple of the indices of a random subset of the leaves
+        of self.language, each included with probability
+        self.swarm_probability. At least one leaf is always included.
+
+        Restricting a program to a few operations makes long runs of any one
+        of them far more likely than when every program can use everything,
+        and different subsets find different bugs.
+        """
+        n = len(self.language.leaves)
+        enabled = tuple(
+            i for i in xrange(n) if random.random() < self.swarm_probability
+        )
+        return enabled or (random.randrange(n),)
+
+    def enable(self, enabled):
+        """
+        Restrict generation to the leaves of self.language at the indices in
+        enabled, or allow all of them if enabled is None.
+        """
+        if enabled != self.enabled:
+            self.enabled = enabled
+            self.weigh()
+
+    def adapt(self, program, failed):
+        """
+        Update the weights of this machine's language after generating
+        program. Each operation which has raised the exception ending a
+        failing program, and each group of operations containing one, gets
+        self.adaptive_limit times its usual weight, so that the rest of the
+        search concentrates on the operations which are finding bugs.
+        """
+        if not failed:
+            return
+        language = self.language
+        failures = self.operation_failures
+        if len(failures) != len(language.leaves):
+            failures[:] = [0] * len(language.leaves)
+        failures[language.encode(program[-1])[0]] += 1
+        self.weigh()
+
+    def weigh(self):
+        """
+        Set the weights of self.language from the failures recorded by adapt
+        and the operations enabled by enable.
+        """
+        language = self.language
+        total_failures = _running_totals(self.operation_failures)
+        total_enabled = None
+        if self.enabled is not None:
+            enabled = [0] * len(language.leaves)
+            for i in self.enabled:
+                enabled[i] = 1
+            total_enabled = _running_totals(enabled)
+        limit = self.adaptive_limit
+
+        def multiplier(start, end):
+            if (
+                total_enabled is not None and
+                total_enabled[end] == total_enabled[start]
+            ):
+                return 0
+            if (
+                end < len(total_failures) and
+                total_failures[end] > total_failures[start]
+            ):
+                return limit
+            return 1
+        language.scale(multiplier)
+
+    def out_of_time(self):
+        return self.deadline is not None and clock() >= self.deadline
+
+    def finish_tracing(self, tracing):
+        """
+        Stop tracing memory allocations if this machine tracks memory growth,
+        and so may have started tracing, unless tracing says that it was
+        already tracing before. Every method which runs programs and leaves
+        the machine idle once it returns calls this when it does.
+        """
+        if self.memory_growth is not None and not tracing and is_tracing():
+            stop_tracing()
+
+    def start_budget(self, budget):
+        """
+        Set self.deadline to budget seconds from now, or to no deadline if
+        budget is None.
+        """
+        self.deadline = None if budget is None else clock() + budget
 
     def find_failing_program(
         self,
     ):
-        examples_found = 0
-        best_example = None
+        """
+        Search for failing programs until self.good_enough of them have been
+        found, returning the shortest. The search is limited to self.n_iters
+        programs, or if self.time_budget is set to that many seconds.
 
-        for _ in range(self.n_iters):
-            program = []
-            context = RunContext()
-            for _ in xrange(self.prog_length):
-                operation = self.language.generate(context)
-                program.append(operation)
-                try:
-                    context.execute(operation)
-                except Exception:
-                    examples_found += 1
+        With more than one of self.workers, each searches its own share of
+        the programs and they all stop once self.good_enough failures have
+        been found between them. How far each worker gets before then
+        depends on how the processes are scheduled, so unlike a search in a
+        single process the result is not reproducible from self.seed. Ties
+        in length between workers are broken by worker rather than by which
+        finished first.
+        """
+        # Start each search from the same weights so that seeded searches
+        # are reproducible, and so that a search which is not adaptive does
+        # not inherit the weights an earlier adaptive one ended with.
+        self.operation_failures = []
+        self.weigh()
+        random = Random(self.seed)
+        seeds = [random.getrandbits(64) for _ in xrange(max(self.workers, 1))]
+        stats = SearchStats(self.report_interval)
+        self.search_stats = stats
+        self.start_budget(self.time_budget)
+        n_iters = self.n_iters if self.time_budget is None else None
+        tracing = is_tracing()
+
+        try:
+            if len(seeds) > 1:
+                best_example = self._find_failing_program_in_parallel(
+                    seeds, n_iters, stats
+                )
+            else:
+                best_example = None
+                for _, program in self.failing_programs(
+                    Random(seeds[0]), n_iters, stats=stats
+                ):
                     if (
                         (best_example is None) or
                         (len(program) < len(best_example))
                     ):
                         best_example = program
-                    if examples_found >= self.good_enough:
-                        return best_example
-                    else:
+                    if stats.failures >= self.good_enough:
                         break
+        finally:
+            self.deadline = None
+            self.enable(None)
+            self.finish_tracing(tracing)
+        self.inform("Search: %s" % (stats,))
+
         if best_example is None:
-            raise NoFailingProgram(
-                ("Unable to find a failing program of length <= %d"
-                 " after %d iterations") % (self.prog_length, self.n_iters)
-            )
+            raise self._no_failing_program()
         return best_example
 
+    def _no_failing_program(self):
+        if self.time_budget is None:
+            limit = "%d iterations" % (self.n_iters,)
+        else:
+            limit = "%g seconds" % (self.time_budget,)
+        return NoFailingProgram(
+            ("Unable to find a failing program of length <= %d"
+             " after %s") % (self.prog_length, limit)
+        )
+
+    def search_and_minimize(self):
+        """
+        Search for failing programs and minimize them at the same time,
+        returning a pair (original, minimal) of the failing program which
+        minimized furthest and what it minimized to.
+
+        Each of self.workers processes searches as find_failing_program
+        does, but breaks off to minimize each failure shorter than any found
+        before it as soon as one turns up, so that minimization need not wait
+        for the search to finish. Which failure wins depends on how the
+        processes are scheduled, so unlike find_failing_program this is not
+        reproducible from self.seed.
+        """
+        self.operation_failures = []
+        self.weigh()
+        random = Random(self.seed)
+        seeds = [random.getrandbits(64) for _ in xrange(max(self.workers, 1))]
+        stats = SearchStats(self.report_interval)
+        self.search_stats = stats
+        self.start_budget(self.time_budget)
+        n_iters = self.n_iters if self.time_budget is None else None
+        executions = self.executions
+        try:
+            result = pipeline(self, seeds, n_iters, stats)
+        finally:
+            self.deadline = None
+        self.inform("Search: %s" % (stats,))
+        if result is None:
+            raise self._no_failing_program()
+        original, minimal, count = result
+        self.inform((
+            "Minimized %d of the failures found during the search, the best "
+            "from %d to %d steps, with %d executions in %.1fs"
+        ) % (
+            count, len(original), len(minimal), self.executions - executions,
+            stats.elapsed,
+        ))
+        return original, minimal
+
+    def _find_failing_program_in_parallel(self, seeds, n_iters, stats):
+        results = find_failing_programs(self, seeds, n_iters, stats)
+        # Sorting on the worker index as well as the length means that ties
+        # are broken the same way regardless of which worker finished first.
+        results = sorted(
+            (result[1], i, result[0])
+            for i, result in enumerate(results)
+            if result is not None
+        )
+        if not results:
+            return None
+        return serialization.loads(self, results[0][2])
+
+    def compress(self, program, enabled=None):
+        """
+        Return program, a sequence of operations generated by this machine, as
+        a compact Program generated from the leaves in enabled. Programs
+        containing operations from anywhere else, such as those generated by
+        a Language subclass, are returned unchanged.
+        """
+        if isinstance(program, Program):
+            return program
+        try:
+            return Program.from_operations(self.language, program, enabled)
+        except ValueError:
+            return program
+
+    def maximize_cost(self):
+        """
+        Hill climb towards programs which cost as much as possible by
+        self.objective, returning a pair (program, cost) of the costliest
+        found. The search is limited to self.n_iters programs, or if
+        self.time_budget is set to that many seconds.
+
+        The first self.elite_size programs are generated at random, and after
+        that each is a random mutation of one of the self.elite_size costliest
+        so far, which it replaces among them if it costs more than the
+        cheapest of them.
+        """
+        random = Random(self.seed)
+        stats = SearchStats(self.report_interval)
+        self.search_stats = stats
+        self.start_budget(self.time_budget)
+        n_iters = self.n_iters if self.time_budget is None else None
+        elite = []
+        tracing = is_tracing()
+        try:
+            for _ in self.iterations(n_iters):
+                # Only Programs can be mutated, so elite programs with
+                # operations from outside the language are never built on.
+                programs = [p for _, p in elite if isinstance(p, Program)]
+                if len(elite) < self.elite_size or not programs:
+                    program, _ = self.generate_program(
+                        Random(random.getrandbits(64))
+                    )
+                else:
+                    program = mutate(
+                        random, random.choice(programs), programs,
+                        self.prog_length,
+                    )
+                pruned, cost = self.measure_cost(program)
+                self.record_program(pruned, False, stats)
+                pruned = self.compress(pruned)
+                if len(elite) < self.elite_size:
+                    elite.append((cost, pruned))
+                else:
+                    cheapest = min(
+                        xrange(len(elite)), key=lambda j: elite[j][0]
+                    )
+                    if cost > elite[cheapest][0]:
+                        elite[cheapest] = (cost, pruned)
+        finally:
+            self.deadline = None
+            self.finish_tracing(tracing)
+        self.inform("Search: %s" % (stats,))
+        if not elite:
+            raise self._no_failing_program()
+        cost, program = max(elite, key=lambda e: e[0])
+        return program, cost
+
+    def measure_cost(self, program):
+        """
+        Run program as prune_and_evaluate does, skipping steps which are not
+        applicable and stopping at the first to raise an exception, and
+        measure its cost by self.objective. Returns a pair (pruned, cost) of
+        the steps that were run and the cost of running them.
+        """
+        self.executions += 1
+        context = self.new_context(trace=False)
+        objective = self.objective
+        objective.start()
+        results, _ = self.run_pruned(context, program)
+        return results, objective.finish(context)
+
     def run_program(self, program):
-        context = RunContext()
-        context.run_program(program)
+        self.executions += 1
+        tracing = is_tracing()
+        try:
+            context = self.new_context()
+            context.run_program(program)
+        finally:
+            self.finish_tracing(tracing)
         return context
 
     def program_fails(self, program):
+        if self.minimum_cost is not None:
+            return self.prune_and_evaluate(program)[1]
         try:
             self.run_program(program)
             return False
+        except LatencyBudgetExceeded:
+            return self.too_slow(program)
         except Exception:
             return True
 
+    def too_slow(self, program):
+        """
+        Called when a step of program has just exceeded its latency budget.
+        Runs program again self.latency_reruns times and returns True only if
+        it fails every time, so that one slow run caused by noise is not taken
+        for a failure. If it is not then the step is treated as having passed.
+        """
+        for _ in xrange(self.latency_reruns):
+            self.executions += 1
+            context = self.new_context(trace=False)
+            try:
+                context.run_program(program)
+            except Exception:
+                continue
+            return False
+        return True
+
     def prune_program(self, program):
-        context = RunContext()
+        return self.prune_and_evaluate(program)[0]
+
+    def prune_and_evaluate(self, program):
+        """
+        Run program in a fresh context, skipping any steps which are not
+        applicable when they are reached and stopping at the first step to
+        raise an exception. Returns a pair (pruned, failed) of the steps that
+        were run and whether the last of them failed.
+
+        Running pruned again would do exactly the same thing, so this tells us
+        both what a candidate program prunes down to and whether that fails
+        in a single execution.
+
+        While self.minimum_cost is set, which it is while shrinking a program
+        found by run_objective, a program fails if its cost by self.objective
+        is at least that instead.
+        """
+        if self.minimum_cost is not None:
+            pruned, cost = self.measure_cost(program)
+            return pruned, cost >= self.minimum_cost
+        self.executions += 1
+        return self.run_pruned(self.new_context(trace=False), program)
+
+    def run_pruned(self, context, program):
+        """
+        Run program in context as prune_and_evaluate does, returning the
+        same pair (pruned, failed).
+        """
         results = []
+        profiler = self.profiler
         for operation in program:
-            if not operation.applicable(context):
+            if profiler is None:
+                applicable = operation.applicable(context)
+            else:
+                applicable = profiler.call(
+                    APPLICABLE, operation.applicable, context
+                )
+            if not applicable:
                 continue
             results.append(operation)
             try:
                 context.execute(operation)
+            except LatencyBudgetExceeded:
+                if self.too_slow(results):
+                    return results, True
             except Exception:
-                break
+                return results, True
+        return results, False
 
-        return results
+    def evaluate_candidate(self, program):
+        """
+        As prune_and_evaluate, but answered from self.outcomes without running
+        anything if this exact sequence of operations, or the program it
+        prunes down to, has been tried before.
+        """
+        key = tuple(program)
+        result = self.outcomes.get(key)
+        if result is None:
+            result = self.prune_and_evaluate(program)
+            self.outcomes.put(key, result)
+            self.outcomes.put(tuple(result[0]), result)
+        return result
 
-    def minimize_failing_program(self, program):
-        assert self.program_fails(program)
-        current_best = program
+    def first_failing(self, candidates):
+        """
+        Evaluate candidate programs in order, returning the program that the
+        first failing one prunes down to, or None if none of them fail.
+
+        If there is a candidate pool then candidates are sent to it in batches.
+        The whole batch is evaluated, but the result is always the first
+        failing candidate in order, so it does not depend on which worker
+        finishes first.
+
+        Returns None without evaluating anything further once we are out of
+        time.
+        """
+        pool = self.candidate_pool
+        if pool is None:
+            for candidate in candidates:
+                if self.out_of_time():
+                    return None
+                pruned, failed = self.evaluate_candidate(candidate)
+                if failed:
+                    return pruned
+            return None
+
+        candidates = iter(candidates)
         while True:
-            for i in xrange(len(current_best)):
-                edit = list(current_best)
-                del edit[i]
-                pruned_edit = self.prune_program(edit)
-                if self.program_fails(pruned_edit):
-                    current_best = pruned_edit
+            batch = list(islice(candidates, pool.size))
+            if not batch or self.out_of_time():
+                return None
+            results = [self.outcomes.get(tuple(c)) for c in batch]
+            for result in results:
+                if result is None:
                     break
-                if i < len(edit):
-                    del edit[i]
-                    pruned_edit = self.prune_program(edit)
-                    if self.program_fails(pruned_edit):
-                        current_best = pruned_edit
-                        break
+                if result[1]:
+                    return result[0]
+            pending = [i for i, r in enumerate(results) if r is None]
+            self.executions += len(pending)
+            evaluated = pool.evaluate([batch[i] for i in pending])
+            for i, result in zip(pending, evaluated):
+                results[i] = result
+                self.outcomes.put(tuple(batch[i]), result)
+                self.outcomes.put(tuple(result[0]), result)
+            for pruned, failed in results:
+                if failed:
+                    return pruned
+
+    def minimize_failing_program(self, program):
+        """
+        Shrink program, which must fail, to a shorter program which still
+        fails, using the strategy named by self.minimizer. Whatever the
+        strategy, the result is polished off with a greedy pass so that no
+        single step or adjacent pair of steps can be deleted from it.
+
+        If self.minimize_budget is set then minimization stops after that many
+        seconds and returns the shortest failing program found so far.
+
+        If program is a Program then so is the result.
+        """
+        if isinstance(program, Program):
+            return Program.from_operations(
+                program.language,
+                self.minimize_failing_program(list(program)),
+                program.enabled,
+            )
+        if self.minimum_cost is None:
+            # A noisy cost may fall below the minimum on any one run, so a
+            # program is only expected to fail when searching for failures.
+            assert self.program_fails(program)
+        try:
+            strategy = MINIMIZERS[self.minimizer]
+        except KeyError:
+            raise ValueError("Unknown minimizer %r. Expected one of %s" % (
+                self.minimizer, ', '.join(sorted(MINIMIZERS))
+            ))
+        self.start_budget(self.minimize_budget)
+        tracing = is_tracing()
+        try:
+            program = self.slice_failing_program(program)
+            if self.workers > 1:
+                self.candidate_pool = CandidatePool(
+                    self, program, self.workers
+                )
+            if strategy is not None:
+                program = strategy(self, program)
+            return self.greedy_minimize(program)
+        finally:
+            # The cache keeps every operation it has seen alive, and results
+            # are not expected to carry over between failing programs.
+            self.outcomes.clear()
+            self.deadline = None
+            self.finish_tracing(tracing)
+            if self.candidate_pool is not None:
+                self.candidate_pool.close()
+                self.candidate_pool = None
+
+    def slice_failing_program(self, program):
+        """
+        Use the dataflow of a run of program to cut it down to just the steps
+        that its failing step depends on. Tries a tight slice first and then a
+        conservative one that allows for operations mutating their arguments,
+        returning the first of those that still fails, or program if neither
+        does.
+        """
+        context = self.new_context()
+        self.executions += 1
+        try:
+            context.run_program(program)
+            return program
+        except Exception:
+            pass
+        for conservative in (False, True):
+            keep = dataflow_slice(context.log, conservative)
+            if all(keep):
+                break
+            sliced, failed = self.evaluate_candidate([
+                step.operation for step, k in zip(context.log, keep) if k
+            ])
+            if failed:
+                return sliced
+        return program
+
+    def delta_debug(self, program):
+        """
+        Shrink a failing program with a variant of Zeller's ddmin: repeatedly
+        try deleting each of n equally sized chunks, doubling n whenever no
+        chunk can be deleted.
+
+        Failures happen at the last step of a program, so most of what comes
+        before is usually irrelevant. We start by bisecting for the longest
+        prefix which can be removed outright.
+        """
+        current = self.drop_prefix(program)
+        n = 2
+        while len(current) >= 2:
+            chunk = (len(current) + n - 1) // n
+            result = self.first_failing(
+                current[:start] + current[start + chunk:]
+                for start in xrange(0, len(current), chunk)
+            )
+            if result is not None:
+                current = result
+                n = max(n - 1, 2)
+            else:
+                if n >= len(current):
+                    break
+                n = min(n * 2, len(current))
+        return current
+
+    def drop_prefix(self, program):
+        """
+        Binary search for the largest i such that program[i:] still fails.
+        This assumes that failure is monotonic in the prefix length, which
+        need not be true, but we only ever move to programs which do fail.
+        """
+        current = program
+        lo = 0
+        hi = len(program)
+        while lo + 1 < hi and not self.out_of_time():
+            mid = (lo + hi) // 2
+            pruned_edit, failed = self.evaluate_candidate(program[mid:])
+            if failed:
+                lo = mid
+                current = pruned_edit
             else:
+                hi = mid
+        return current
+
+    def greedy_minimize(self, program):
+        current_best = program
+        while True:
+            result = self.first_failing(greedy_edits(current_best))
+            if result is None:
                 return current_best
+            current_best = result
+
+
+def _median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def _running_totals(values):
+    totals = [0]
+    for v in values:
+        totals.append(totals[-1] + v)
+    return totals
+
+
+def greedy_edits(program):
+    """
+    Yield every program formed by deleting either a single step or two
+    adjacent steps from program, in order of the first step deleted.
+    """
+    for i in xrange(len(program)):
+        yield program[:i] + program[i + 1:]
+        if i + 1 < len(program):
+            yield program[:i] + program[i + 2:]
+
+
+MINIMIZERS = {
+    "greedy": None,
+    "ddmin": TestMachine.delta_debug,
+}
@@ -1,6 +1,29 @@
+import io
+import json
+import operator
+import os
 import pytest
-from testmachine import TestMachine
-from .common import generate
+import time
+from random import Random
+from testmachine import TestMachine, consume
+from .common import (
+    basic_operations, binary_operation, check, generate, ints, operation,
+    weighted,
+)
+from .operations import (
+    ChooseFrom, InapplicableLanguage, Language, Push, alias_table
+)
+from .objectives import Counter, WallTime
+from .corpus import Corpus
+from . import mutation
+from . import serialization
+from .profiling import APPLICABLE, GENERATE
+from .program import Program
+from .database import ExampleDatabase
+from .testmachine import (
+    LatencyBudgetExceeded, MemoryGrowthExceeded, NoFailingProgram,
+    OutcomeCache, RunContext,
+)
 
 
 def test_does_not_hide_error_in_generate():
@@ -11,3 +34,850 @@ def test_does_not_hide_error_in_generate():
     machine.add(generate(broken, "broken"))
     with pytest.raises(ValueError):
         machine.run()
+
+
+def test_consuming_operations_require_the_stack_they_consume_from():
+    language = ChooseFrom([
+        generate(lambda r: r.randint(0, 10), "ints"),
+        operation(
+            operator.add, (consume("ints"), consume("ints")), target="ints",
+            name="+",
+        ),
+    ])
+    context = RunContext(random=Random(0))
+    assert language.candidates(context) == language.children[:1]
+    context.varstack("ints").push(1)
+    context.varstack("ints").push(2)
+    assert len(language.candidates(context)) == 2
+
+
+def test_parallel_search_finds_failing_program():
+    machine = TestMachine(workers=2, seed=1, print_output=False)
+    machine.add(
+        generate(lambda r: r.randint(0, 10), "ints"),
+        check(lambda x: x < 10, ("ints",)),
+    )
+    program = machine.find_failing_program()
+    assert machine.program_fails(program)
+
+
+def test_seeded_search_is_reproducible():
+    def make_machine():
+        machine = TestMachine(seed=3, print_output=False)
+        machine.add(
+            generate(lambda r: r.randint(0, 100), "ints"),
+            check(lambda x: x < 90, ("ints",)),
+        )
+        return machine
+
+    def values(program):
+        return [op.args() for op in program]
+
+    assert values(make_machine().find_failing_program()) == values(
+        make_machine().find_failing_program()
+    )
+
+
+def test_language_is_reused_until_more_languages_are_added():
+    machine = TestMachine()
+    machine.add(generate(lambda r: 1, "ints"))
+    language = machine.language
+    assert machine.language is language
+    machine.add(check(lambda x: True, ("ints",)))
+    assert machine.language is not language
+    assert len(machine.language.children) == 2
+
+
+def test_choose_from_only_picks_applicable_operations():
+    language = ChooseFrom([
+        check(lambda x: True, ("ints",), name="one"),
+        check(lambda x, y: True, ("ints", "ints"), name="two"),
+        check(lambda x: True, ("ints",), name="never"),
+    ])
+    language.children[2].precondition = lambda x: False
+    context = RunContext(random=Random(0))
+    context.varstack("ints").push(1)
+    counts = {}
+    for _ in range(1000):
+        name = language.generate(context).name
+        counts[name] = counts.get(name, 0) + 1
+    assert list(counts) == ["one"]
+
+    context.varstack("ints").push(2)
+    counts = {}
+    for _ in range(1000):
+        name = language.generate(context).name
+        counts[name] = counts.get(name, 0) + 1
+    assert sorted(counts) == ["one", "two"]
+    assert 400 <= counts["one"] <= 600
+
+
+def test_alias_table_samples_in_proportion_to_weights():
+    weights = [1, 2, 3, 0, 4]
+    probabilities, aliases = alias_table(weights)
+    random = Random(0)
+    counts = [0] * len(weights)
+    for _ in range(10000):
+        i = random.randrange(len(weights))
+        if random.random() >= probabilities[i]:
+            i = aliases[i]
+        counts[i] += 1
+    assert counts[3] == 0
+    for count, weight in zip(counts, weights):
+        assert abs(count - 1000 * weight) < 150
+
+
+def test_weighted_children_are_chosen_more_often():
+    language = ChooseFrom([
+        weighted(9, check(lambda x: True, ("ints",), name="heavy")),
+        check(lambda x: True, ("ints",), name="light"),
+        weighted(5, check(lambda x: True, ("ints",), name="never")),
+    ])
+    language.children[2].precondition = lambda x: False
+    assert not language.uniform
+    context = RunContext(random=Random(0))
+    context.varstack("ints").push(1)
+    counts = {}
+    for _ in range(1000):
+        name = language.generate(context).name
+        counts[name] = counts.get(name, 0) + 1
+    assert sorted(counts) == ["heavy", "light"]
+    assert 850 <= counts["heavy"] <= 950
+
+
+def test_adaptive_search_favours_operations_which_fail():
+    machine = summing_machine(adaptive=True)
+    program = machine.find_failing_program()
+    assert machine.program_fails(program)
+    weights = dict(zip(
+        [getattr(c, "name", None) for c in machine.language.children],
+        machine.language.weights,
+    ))
+    assert weights["small"] == machine.adaptive_limit
+    assert weights["+"] == 1
+
+    again = summing_machine(adaptive=True)
+    assert again.find_failing_program().steps == program.steps
+
+    machine.adaptive = False
+    machine.find_failing_program()
+    assert machine.language.uniform
+
+
+def test_choose_from_raises_when_nothing_is_applicable():
+    language = ChooseFrom([check(lambda x: True, ("ints",))])
+    with pytest.raises(InapplicableLanguage):
+        language.generate(RunContext())
+
+
+def test_choose_from_requirements_are_shared_by_all_children():
+    language = ChooseFrom([
+        check(lambda x, y: True, ("ints", "ints")),
+        check(lambda x, y: True, ("ints", "lists")),
+    ])
+    assert language.requirements == {"ints": 1}
+
+
+def summing_machine(**kwargs):
+    machine = TestMachine(print_output=False, seed=0, **kwargs)
+    machine.add(
+        basic_operations("ints"),
+        generate(lambda r: r.randint(0, 10), "ints"),
+        binary_operation(operator.add, "ints", "+"),
+        check(lambda x: x < 30, ("ints",), name="small"),
+    )
+    return machine
+
+
+@pytest.mark.parametrize("minimizer", ["ddmin", "greedy"])
+def test_minimizers_produce_short_failing_programs(minimizer):
+    machine = summing_machine(minimizer=minimizer)
+    program = machine.find_failing_program()
+    minimal = machine.minimize_failing_program(program)
+    assert machine.program_fails(minimal)
+    assert len(minimal) <= len(program)
+    assert len(minimal) <= 12
+
+
+def test_unknown_minimizer_is_an_error():
+    machine = summing_machine(minimizer="magic")
+    with pytest.raises(ValueError):
+        machine.minimize_failing_program(machine.find_failing_program())
+
+
+def test_slicing_drops_steps_the_failure_does_not_depend_on():
+    machine = TestMachine(print_output=False, seed=0, prog_length=50)
+    machine.add(
+        basic_operations("noise"),
+        generate(lambda r: r.random(), "noise"),
+        generate(lambda r: r.randint(0, 100), "ints"),
+        check(lambda x: x < 95, ("ints",)),
+    )
+    program = machine.find_failing_program()
+    sliced = machine.slice_failing_program(program)
+    assert machine.program_fails(sliced)
+    assert len(sliced) == 2
+
+
+def test_slicing_keeps_operations_which_mutate_their_arguments():
+    machine = TestMachine(print_output=False, seed=0)
+    machine.add(
+        generate(lambda r: [], "lists"),
+        generate(lambda r: 1, "ints"),
+        operation(lambda x, y: x.append(y), ("lists", "ints"), name="append"),
+        check(lambda x: len(x) < 3, ("lists",)),
+    )
+    program = machine.find_failing_program()
+    sliced = machine.slice_failing_program(program)
+    assert machine.program_fails(sliced)
+    assert [op.name for op in sliced].count("append") >= 3
+
+
+def test_outcome_cache_evicts_least_recently_used():
+    cache = OutcomeCache(2)
+    cache.put("a", True)
+    cache.put("b", False)
+    assert cache.get("a") is True
+    cache.put("c", True)
+    assert cache.get("b") is None
+    assert cache.get("a") is True
+    assert cache.get("c") is True
+    assert (cache.hits, cache.misses) == (3, 1)
+    assert len(cache) == 2
+
+
+def test_minimizer_does_not_rerun_repeated_candidates():
+    machine = summing_machine(minimizer="greedy")
+    program = machine.find_failing_program()
+    machine.minimize_failing_program(program)
+    assert machine.outcomes.hits > 0
+    assert len(machine.outcomes) == 0
+
+
+def test_prune_and_evaluate_runs_the_program_once():
+    machine = summing_machine()
+    program = machine.find_failing_program()
+    edit = list(program)[1:]
+    machine.executions = 0
+    pruned, failed = machine.prune_and_evaluate(edit)
+    assert machine.executions == 1
+    assert pruned == machine.prune_program(edit)
+    assert failed == machine.program_fails(pruned)
+
+
+def test_parallel_minimization_matches_sequential():
+    program = summing_machine(prog_length=100).find_failing_program()
+    results = []
+    for workers in (1, 3):
+        machine = summing_machine(workers=workers)
+        results.append(machine.minimize_failing_program(program))
+    assert results[0] == results[1]
+
+
+def test_failing_programs_are_stored_compactly():
+    machine = summing_machine()
+    program = machine.find_failing_program()
+    assert isinstance(program, Program)
+    assert machine.program_fails(program)
+    assert machine.prune_program(program)
+    assert [op.args() for op in program] == [op.args() for op in program]
+    decoded = list(program)
+    assert Program.from_operations(machine.language, decoded) == program
+    assert len(program[1:]) == len(program) - 1
+    assert program[-1].name == "small"
+
+
+def test_program_values_are_regenerated_fresh_on_each_run():
+    machine = TestMachine(print_output=False, seed=0)
+    machine.add(
+        generate(lambda r: [], "lists"),
+        generate(lambda r: 1, "ints"),
+        operation(lambda x, y: x.append(y), ("lists", "ints"), name="append"),
+        check(lambda x: len(x) < 3, ("lists",)),
+    )
+    program = machine.find_failing_program()
+    assert machine.program_fails(program)
+    assert machine.program_fails(program)
+
+
+def test_generators_are_called_once_per_step_during_search():
+    machine = TestMachine(print_output=False, seed=0, prog_length=20)
+    machine.add(
+        generate(lambda r: r.randint(0, 10), "ints"),
+        check(lambda x: True, ("ints",)),
+    )
+    context = RunContext(random=Random(0))
+    language = machine.language
+    pushes = 0
+    for _ in range(20):
+        operation = language.generate(context)
+        pushes += operation.name == "push"
+        context.execute(operation)
+    assert machine.generator_calls == pushes
+
+
+def test_debug_contexts_check_stack_integrity():
+    context = RunContext(debug=True)
+    varstack = context.varstack("ints")
+    varstack.push(1)
+    varstack.names.append(2)
+    with pytest.raises(AssertionError):
+        varstack.peek()
+    assert RunContext().varstack("ints").__class__ is not varstack.__class__
+
+
+def test_variables_are_named_when_the_log_is_printed(capsys):
+    machine = summing_machine()
+    machine.print_output = True
+    context = machine.run()
+    assert all(
+        isinstance(v, int)
+        for step in context.log for v in step.arguments + step.definitions
+    )
+    out = capsys.readouterr().out
+    assert "assert small(t" in out
+
+
+def test_untraced_contexts_record_nothing():
+    machine = summing_machine()
+    program = machine.find_failing_program()
+    context = RunContext(trace=False)
+    with pytest.raises(AssertionError):
+        context.run_program(program)
+    assert context.log == []
+    assert context.var_index == 0
+
+    traced = machine.run_program(list(program)[:-1])
+    assert len(traced.log) == len(program) - 1
+
+
+def test_time_budget_replaces_iteration_limit():
+    machine = TestMachine(
+        print_output=False, n_iters=1, prog_length=10, time_budget=0.2
+    )
+    machine.add(
+        generate(lambda r: r.randint(0, 10), "ints"),
+        check(lambda x: True, ("ints",)),
+    )
+    with pytest.raises(NoFailingProgram):
+        machine.find_failing_program()
+    stats = machine.search_stats
+    assert stats.programs > 1
+    assert stats.operations >= stats.programs
+    assert stats.failures == 0
+    assert 0.2 <= stats.elapsed < 5
+    assert stats.first_failure is None
+
+    machine = summing_machine()
+    machine.find_failing_program()
+    stats = machine.search_stats
+    assert 0 <= stats.first_failure <= stats.elapsed
+    assert 1 <= stats.programs_to_first_failure <= stats.programs
+
+
+def test_exhausted_minimize_budget_returns_best_so_far():
+    machine = summing_machine(minimize_budget=0)
+    program = machine.find_failing_program()
+    minimal = machine.minimize_failing_program(program)
+    assert machine.program_fails(minimal)
+    assert len(minimal) <= len(program)
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_profiler_records_each_operation(workers):
+    machine = summing_machine(profile=True, workers=workers)
+    machine.run()
+    stats = machine.profiler.as_dict()
+    assert stats["small"]["exceptions"] >= 1
+    assert stats["push"]["calls"] >= stats["+"]["calls"]
+    assert stats[GENERATE]["calls"] >= stats["push"]["calls"]
+    assert APPLICABLE in stats
+    for values in stats.values():
+        assert values["max"] <= values["total"]
+    assert json.loads(machine.profiler.to_json()) == stats
+    report = machine.profiler.report().splitlines()
+    assert len(report) == len(stats) + 1
+
+
+def test_serialized_programs_round_trip():
+    machine = summing_machine()
+    program = machine.find_failing_program()
+    data = serialization.dumps(machine, program)
+    assert len(data) < 6 * len(program) + 32
+    loaded = serialization.loads(summing_machine(), data)
+    assert loaded.steps == program.steps
+    assert machine.program_fails(loaded)
+
+    stream = io.BytesIO()
+    serialization.dump(machine, program, stream)
+    serialization.dump(machine, program[:2], stream)
+    stream.seek(0)
+    assert serialization.load(machine, stream) == program
+    assert serialization.load(machine, stream) == program[:2]
+    with pytest.raises(EOFError):
+        serialization.load(machine, stream)
+
+
+def test_serialized_programs_only_load_into_the_same_machine():
+    machine = summing_machine()
+    data = serialization.dumps(machine, machine.find_failing_program())
+    other = TestMachine()
+    other.add(generate(lambda r: r.randint(0, 10), "ints"))
+    for bad in [data[:-1], b"XYZ" + data[3:], data]:
+        with pytest.raises(serialization.SerializationError):
+            serialization.loads(other if bad is data else machine, bad)
+
+
+def test_database_replays_failures_and_evicts_fixed_ones(tmpdir):
+    path = str(tmpdir)
+    machine = summing_machine(database=path)
+    machine.run()
+    key = machine.fingerprint
+    saved = list(ExampleDatabase(path).fetch(key))
+    assert len(saved) == 1
+
+    replaying = summing_machine(database=path, n_iters=0)
+    assert replaying.replay_database(ExampleDatabase(path)) is not None
+    replaying.run()
+    assert list(ExampleDatabase(path).fetch(key)) == saved
+
+    fixed = TestMachine(print_output=False, n_iters=0, database=path)
+    fixed.add(
+        basic_operations("ints"),
+        generate(lambda r: r.randint(0, 10), "ints"),
+        binary_operation(operator.add, "ints", "+"),
+        check(lambda x: True, ("ints",), name="small"),
+    )
+    assert fixed.fingerprint == key
+    fixed.run()
+    assert list(ExampleDatabase(path).fetch(key)) == []
+
+
+def test_database_skips_programs_deleted_while_fetching(tmpdir, monkeypatch):
+    database = ExampleDatabase(str(tmpdir))
+    database.save("key", b"kept")
+    listdir = os.listdir
+    monkeypatch.setattr(os, "listdir", lambda path: listdir(path) + ["gone"])
+    assert list(database.fetch("key")) == [b"kept"]
+
+
+def test_swarm_programs_only_use_enabled_operations():
+    machine = summing_machine(swarm=True)
+    found = list(machine.failing_programs(Random(0), 200))
+    assert found
+    subsets = set()
+    for seed, program in found:
+        enabled = program.enabled
+        subsets.add(enabled)
+        assert set(program.steps[0::2]) <= set(enabled)
+        assert program[1:].enabled == enabled
+        rebuilt, failed = machine.generate_program(Random(seed), enabled)
+        assert failed
+        assert machine.compress(rebuilt).steps == program.steps
+        loaded = serialization.loads(
+            machine, serialization.dumps(machine, program)
+        )
+        assert loaded.enabled == enabled
+    assert len(subsets) > 1
+
+    program = machine.find_failing_program()
+    assert program.enabled is not None
+    assert machine.minimize_failing_program(program).enabled == (
+        program.enabled
+    )
+    assert machine.enabled is None
+    assert machine.language.uniform
+
+
+def test_swarm_subsets_do_not_decide_the_first_step():
+    def fail():
+        raise ValueError()
+
+    machine = TestMachine(print_output=False, swarm=True)
+    machine.add(
+        operation(fail, (), name="first"), operation(fail, (), name="second"),
+    )
+    first = set(
+        program.steps[0]
+        for _, program in machine.failing_programs(Random(0), 200)
+        if program.enabled == (0, 1)
+    )
+    assert first == set([0, 1])
+
+
+class PushFresh(Language):
+    """
+    A language which makes a new Push for every value, so that none of the
+    operations it generates can be encoded as a Program.
+    """
+
+    def __init__(self, varstack):
+        super(PushFresh, self).__init__()
+        self.varstack = varstack
+
+    def generate(self, context):
+        value = context.random.randint(0, 10)
+        return Push(self.varstack, lambda: value)
+
+
+@pytest.mark.parametrize("mode", ["swarm", "corpus", "maximize"])
+def test_searches_languages_generating_their_own_operations(mode):
+    machine = TestMachine(
+        print_output=False, seed=0, n_iters=200,
+        swarm=mode == "swarm", corpus=mode == "corpus",
+        objective=Counter(lambda: 0) if mode == "maximize" else None,
+    )
+    machine.add(
+        PushFresh("ints"),
+        binary_operation(operator.add, "ints", "+"),
+        check(lambda x: x < 30, ("ints",), name="small"),
+    )
+    if mode == "maximize":
+        program, _ = machine.maximize_cost()
+    else:
+        program = machine.find_failing_program()
+        assert machine.program_fails(program)
+    assert not isinstance(program, Program)
+
+
+@pytest.mark.parametrize("pipelined", [False, True])
+def test_workers_reject_languages_generating_their_own_operations(pipelined):
+    machine = TestMachine(print_output=False, seed=0, workers=2)
+    machine.add(
+        PushFresh("ints"), check(lambda x: x < 10, ("ints",), name="small"),
+    )
+    with pytest.raises(ValueError):
+        if pipelined:
+            machine.search_and_minimize()
+        else:
+            machine.find_failing_program()
+
+
+def test_database_works_with_languages_generating_their_own_operations(
+    tmpdir
+):
+    machine = TestMachine(print_output=False, seed=0, database=str(tmpdir))
+    machine.add(
+        PushFresh("ints"),
+        generate(lambda r: r.randint(0, 10), "ints"),
+        binary_operation(operator.add, "ints", "+"),
+        check(lambda x: x < 30, ("ints",), name="small"),
+    )
+    assert machine.run() is not None
+    assert machine.run() is not None
+
+
+def test_pipeline_minimizes_while_searching():
+    machine = summing_machine(workers=2, prog_length=100)
+    original, minimal = machine.search_and_minimize()
+    assert machine.program_fails(original)
+    assert machine.program_fails(minimal)
+    assert len(minimal) <= len(original)
+    assert machine.executions > 0
+    assert machine.search_stats.failures >= 1
+
+
+def test_pipeline_reraises_errors_from_workers():
+    def broken(r):
+        raise ValueError()
+
+    machine = TestMachine(print_output=False, pipeline=True, workers=2)
+    machine.add(generate(broken, "broken"))
+    with pytest.raises(ValueError):
+        machine.run()
+
+
+def test_operations_may_return_awaitables():
+    asyncio = pytest.importorskip("asyncio")
+    machine = TestMachine(print_output=False, seed=0)
+    machine.add(
+        generate(lambda r: asyncio.sleep(0, r.randint(0, 10)), "ints"),
+        binary_operation(lambda x, y: asyncio.sleep(0, x + y), "ints", "+"),
+        check(lambda x: asyncio.sleep(0, x < 30), ("ints",), name="small"),
+    )
+    program = machine.find_failing_program()
+    context = RunContext()
+    with pytest.raises(AssertionError):
+        context.run_program(program)
+    assert max(context.varstack("ints").data) >= 30
+
+
+def test_concurrent_programs_overlap_their_waits():
+    asyncio = pytest.importorskip("asyncio")
+
+    def slow_machine(concurrency):
+        machine = TestMachine(
+            print_output=False, seed=0, n_iters=16, prog_length=4,
+            concurrency=concurrency,
+        )
+        machine.add(
+            generate(lambda r: r.randint(0, 10), "ints"),
+            check(
+                lambda x: asyncio.sleep(0.005, x < 8), ("ints",),
+                name="small",
+            ),
+        )
+        return machine
+
+    timings = []
+    found = []
+    for concurrency in (1, 8):
+        machine = slow_machine(concurrency)
+        start = time.time()
+        found.append([
+            program.steps
+            for _, program in machine.failing_programs(Random(0), 16)
+        ])
+        timings.append(time.time() - start)
+    assert found[0] and found[0] == found[1]
+    assert timings[1] < timings[0] / 2
+
+
+def test_minimizes_to_an_operation_over_its_latency_budget():
+    machine = TestMachine(print_output=False, seed=0, prog_length=50)
+    machine.add(
+        generate(lambda r: r.randint(0, 10), "ints"),
+        binary_operation(operator.add, "ints", "+"),
+        operation(
+            lambda x: time.sleep(0.02 if x > 15 else 0), ("ints",),
+            name="slow", latency_budget=0.01,
+        ),
+    )
+    minimal = machine.minimize_failing_program(machine.find_failing_program())
+    assert minimal[-1].name == "slow"
+    with pytest.raises(LatencyBudgetExceeded):
+        machine.run_program(minimal)
+
+
+def test_machine_latency_budget_applies_to_every_operation():
+    machine = TestMachine(print_output=False, latency_budget=0.01)
+    nap = operation(lambda: time.sleep(0.02), (), name="nap")
+    quick = operation(
+        lambda: time.sleep(0.02), (), name="quick", latency_budget=1.0
+    )
+    machine.add(nap, quick)
+    assert not machine.program_fails([quick])
+    assert machine.program_fails([nap])
+
+
+def test_searches_for_generators_over_their_latency_budget():
+    machine = TestMachine(print_output=False, seed=0, n_iters=20)
+    machine.add(generate(
+        lambda r: time.sleep(0.02), "slow", latency_budget=0.01,
+    ))
+    program = machine.find_failing_program()
+    assert machine.program_fails(program)
+
+
+def test_generators_over_their_budget_still_push_their_value():
+    calls = [0]
+
+    def slow_once(r):
+        calls[0] += 1
+        if calls[0] == 1:
+            time.sleep(0.02)
+        return 0
+
+    machine = TestMachine(print_output=False, latency_reruns=2)
+    machine.add(generate(slow_once, "ints", latency_budget=0.01))
+    context = machine.new_context(random=Random(0), trace=False)
+    heights = []
+    for _ in range(3):
+        operation = machine.language.generate(context)
+        try:
+            context.execute(operation)
+        except LatencyBudgetExceeded:
+            assert not machine.too_slow([operation])
+        heights.append(len(context.varstack("ints").data))
+    assert heights == [1, 2, 3]
+
+
+def test_latency_reruns_ignore_one_off_slow_calls():
+    calls = [0]
+
+    def sometimes_slow():
+        calls[0] += 1
+        if calls[0] == 1:
+            time.sleep(0.02)
+
+    machine = TestMachine(print_output=False, latency_reruns=2)
+    nap = operation(sometimes_slow, (), name="nap", latency_budget=0.01)
+    machine.add(nap)
+    assert not machine.program_fails([nap])
+    assert machine.prune_and_evaluate([nap, nap]) == ([nap, nap], False)
+
+
+def quadratic_machine(comparisons, **kwargs):
+    def compare_all(xs):
+        comparisons[0] += len(xs) * (len(xs) - 1) // 2
+        return xs
+
+    machine = TestMachine(
+        print_output=False, seed=0, prog_length=50,
+        objective=Counter(lambda: comparisons[0]), **kwargs
+    )
+    machine.add(
+        basic_operations("lists"),
+        generate(lambda r: [], "lists"),
+        generate(lambda r: r.randint(0, 10), "ints"),
+        operation(
+            lambda xs, x: xs + [x], ("lists", "ints"), target="lists",
+            name="append",
+        ),
+        operation(compare_all, ("lists",), target="lists", name="compare"),
+    )
+    return machine
+
+
+def test_hill_climbing_beats_random_programs():
+    comparisons = [0]
+    climbing = quadratic_machine(comparisons, n_iters=400)
+    _, climbed = climbing.maximize_cost()
+    at_random = quadratic_machine(comparisons, n_iters=400)
+    at_random.elite_size = 400
+    _, random_best = at_random.maximize_cost()
+    assert climbed > 2 * random_best
+
+
+def test_shrinks_while_keeping_cost_above_threshold():
+    comparisons = [0]
+    machine = quadratic_machine(comparisons, n_iters=300, cost_threshold=100)
+    context = machine.run()
+    assert context is not None
+    program = [step.operation for step in context.log]
+    assert len(program) < machine.prog_length
+    before = comparisons[0]
+    machine.run_program(program)
+    assert comparisons[0] - before >= 100
+    machine.cost_threshold = 10 ** 9
+    assert machine.run() is None
+
+
+def test_shrinks_programs_costly_in_wall_time():
+    for seed in range(5):
+        machine = TestMachine(
+            print_output=False, seed=seed, n_iters=200, prog_length=30,
+            objective=WallTime(),
+        )
+        machine.add(ints("ints"))
+        machine.run()
+
+
+def test_mutations_only_use_steps_of_the_language():
+    machine = TestMachine(print_output=False)
+    machine.add(
+        generate(lambda r: r.randint(0, 10), "ints"),
+        binary_operation(operator.add, "ints", "+"),
+    )
+    random = Random(0)
+    programs = [
+        Program.from_operations(
+            machine.language, machine.generate_program(Random(i))[0]
+        )
+        for i in range(3)
+    ]
+    for _ in range(100):
+        program = mutation.mutate(random, programs[0], programs, 20)
+        assert len(program) <= 20
+        assert program.language is machine.language
+        assert all(
+            step < len(machine.language.leaves)
+            for step in program.steps[0::2]
+        )
+        machine.prune_and_evaluate(program)
+
+
+def leaky_machine(leak):
+    def remember(x):
+        leak[0] = (bytearray(1000), leak[0])
+        return x
+
+    machine = TestMachine(
+        print_output=False, seed=0, prog_length=100,
+        memory_growth=10000, memory_interval=10,
+    )
+    machine.add(
+        generate(lambda r: r.randint(0, 10), "ints"),
+        binary_operation(operator.add, "ints", "+"),
+        operation(remember, ("ints",), target="ints", name="remember"),
+    )
+    return machine
+
+
+def test_minimizes_programs_which_retain_memory():
+    tracemalloc = pytest.importorskip("tracemalloc")
+    machine = leaky_machine([None])
+    program = machine.find_failing_program()
+    assert not tracemalloc.is_tracing()
+    minimal = machine.minimize_failing_program(program)
+    assert not tracemalloc.is_tracing()
+    assert len(minimal) <= 12
+    with pytest.raises(MemoryGrowthExceeded) as e:
+        machine.run_program(minimal)
+    assert "bytearray(1000)" in str(e.value)
+    assert not tracemalloc.is_tracing()
+
+
+def test_memory_freed_by_the_program_does_not_count_as_growth():
+    tracemalloc = pytest.importorskip("tracemalloc")
+    machine = TestMachine(
+        print_output=False, n_iters=50, memory_growth=10000,
+        memory_interval=1,
+    )
+    machine.add(
+        generate(lambda r: r.randint(0, 10), "ints"),
+        operation(
+            lambda x: len(bytearray(100000)) + x, ("ints",),
+            target="ints", name="scratch",
+        ),
+    )
+    with pytest.raises(NoFailingProgram):
+        machine.find_failing_program()
+    assert not tracemalloc.is_tracing()
+
+
+def test_tracing_started_elsewhere_is_left_on():
+    tracemalloc = pytest.importorskip("tracemalloc")
+    tracemalloc.start()
+    try:
+        leaky_machine([None]).run()
+        assert tracemalloc.is_tracing()
+    finally:
+        tracemalloc.stop()
+
+
+def test_corpus_keeps_novel_programs_and_evicts_common_ones():
+    corpus = Corpus(2)
+    assert corpus.add("a", frozenset(["x"]))
+    assert not corpus.add("b", frozenset(["x"]))
+    assert corpus.add("c", frozenset(["x", "y"]))
+    assert corpus.add("d", frozenset(["z"]))
+    assert sorted(corpus) == ["c", "d"]
+    # Features of evicted programs still do not count as new
+    assert not corpus.add("e", frozenset(["x"]))
+
+
+def test_corpus_mode_reaches_deep_stacks():
+    def deep_machine(corpus):
+        machine = TestMachine(
+            print_output=False, seed=0, n_iters=2000, prog_length=50,
+            corpus=corpus,
+        )
+        machine.add(
+            generate(lambda r: r.randint(0, 10), "ints"),
+            operation(
+                operator.add, (consume("ints"), consume("ints")),
+                target="ints", name="+",
+            ),
+            *[
+                operation(lambda x: None, (consume("ints"),), name="drop")
+                for _ in range(3)
+            ]
+        )
+        machine.add(check(lambda *xs: False, ("ints",) * 10, name="deep"))
+        return machine
+
+    with pytest.raises(NoFailingProgram):
+        deep_machine(False).find_failing_program()
+    program = deep_machine(True).find_failing_program()
+    assert program[-1].name == "deep"